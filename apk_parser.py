@@ -0,0 +1,431 @@
+# coding=utf-8
+"""
+Copyright (C) 2021 37手游安卓团队
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import contextlib
+import mmap
+import os
+import re
+import struct
+import zipfile
+
+# ResChunk_header 的类型
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+RES_TABLE_TYPE_SPEC_TYPE = 0x0202
+
+# ResTable_type 和 ResTable_entry 的标记
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+ENTRY_FLAG_COMPLEX = 0x01
+ENTRY_FLAG_COMPACT = 0x08
+
+# Res_value 的类型
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+
+# android 属性的资源id
+ATTR_MIN_SDK_VERSION = 0x0101020c
+ATTR_TARGET_SDK_VERSION = 0x01010270
+ATTR_VERSION_CODE = 0x0101021b
+ATTR_VERSION_NAME = 0x0101021c
+
+# apktool 记录后缀（而不是文件路径）的不压缩文件
+MEDIA_EXT_PATTERN = re.compile("(jpg|jpeg|png|gif|wav|mp2|mp3|ogg|aac|mpg|mpeg|mid|midi|smf|jet|rtttl|imy|xmf|mp4|"
+                               "m4a|m4v|3gp|3gpp|3g2|3gpp2|amr|awb|wma|wmv|webm|webp|mkv)$")
+
+
+class StringPool:
+    """
+    ResStringPool， 字符串按需解码，大的字符串池（resources.arsc 的key）不需要全部解码
+    """
+
+    def __init__(self, buf, offset: int):
+        _, header_size, _, string_count, _, flags, strings_start, _ = struct.unpack_from("<HHIIIIII", buf, offset)
+        self.buf = buf
+        self.utf8 = bool(flags & 0x100)
+        self.strings_start = offset + strings_start
+        self.offsets = struct.unpack_from(f"<{string_count}I", buf, offset + header_size)
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, index: int) -> str:
+        if index < 0 or index >= len(self.offsets):
+            return ""
+        if index not in self.cache:
+            self.cache[index] = self._decode(self.strings_start + self.offsets[index])
+        return self.cache[index]
+
+    def _decode(self, offset: int) -> str:
+        buf = self.buf
+        if self.utf8:
+            # utf16的长度， utf8的长度， 都是1或者2个字节
+            offset += 2 if buf[offset] & 0x80 else 1
+            length = buf[offset]
+            if length & 0x80:
+                length = ((length & 0x7f) << 8) | buf[offset + 1]
+                offset += 2
+            else:
+                offset += 1
+            return bytes(buf[offset:offset + length]).decode("UTF-8", errors="replace")
+        length = struct.unpack_from("<H", buf, offset)[0]
+        if length & 0x8000:
+            length = ((length & 0x7fff) << 16) | struct.unpack_from("<H", buf, offset + 2)[0]
+            offset += 4
+        else:
+            offset += 2
+        return bytes(buf[offset:offset + length * 2]).decode("UTF-16-LE", errors="replace")
+
+
+def iter_axml_elements(data: bytes):
+    """
+    解析二进制的xml（AndroidManifest.xml）
+    :param data: xml的内容
+    :return: 依次返回 (标签名, 属性列表)， 属性为 (属性名, 资源id, 类型, 值)， 字符串的值已经解码
+    """
+    chunk_type, header_size, size = struct.unpack_from("<HHI", data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise ValueError("不是二进制的xml文件")
+    strings = None
+    resource_ids = ()
+    offset = header_size
+    end = min(size, len(data))
+    while offset + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", data, offset)
+        if chunk_size < 8:
+            raise ValueError(f"xml chunk 大小错误: {offset}")
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = StringPool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from(f"<{(chunk_size - header_size) // 4}I", data, offset + header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE and strings is not None:
+            ext = offset + header_size
+            _, name, attribute_start, attribute_size, attribute_count = struct.unpack_from("<IIHHH", data, ext)
+            attributes = []
+            for i in range(attribute_count):
+                attr = ext + attribute_start + i * attribute_size
+                _, attr_name, raw_value, _, _, value_type, value = struct.unpack_from("<IIIHBBI", data, attr)
+                resource_id = resource_ids[attr_name] if attr_name < len(resource_ids) else 0
+                if value_type == TYPE_STRING:
+                    value = strings.get(value)
+                elif raw_value != 0xffffffff and value_type != TYPE_REFERENCE:
+                    value = strings.get(raw_value)
+                attributes.append((strings.get(attr_name), resource_id, value_type, value))
+            yield strings.get(name), attributes
+        offset += chunk_size
+
+
+def get_attr(attributes, resource_id: int, name: str):
+    """
+    获取属性的值， 优先使用资源id匹配（混淆过的apk属性名可能被去掉了）
+    """
+    for attr_name, attr_resource_id, value_type, value in attributes:
+        if attr_resource_id == resource_id and resource_id:
+            return value_type, value
+    for attr_name, attr_resource_id, value_type, value in attributes:
+        if attr_name == name:
+            return value_type, value
+    return None, None
+
+
+def apk_do_not_compress(apk_zip: zipfile.ZipFile) -> list:
+    """
+    和apktool.yml 里面的doNotCompress 保持一致: apk里面没有压缩的文件, 常见的媒体文件记录后缀，其他的记录文件路径
+    :param apk_zip: apk
+    :return:
+    """
+    do_not_compress = []
+    for info in apk_zip.infolist():
+        if info.is_dir() or info.compress_type != zipfile.ZIP_STORED:
+            continue
+        ext = os.path.splitext(info.filename)[1][1:]
+        if not ext or not MEDIA_EXT_PATTERN.search(ext):
+            ext = info.filename
+        if ext not in do_not_compress:
+            do_not_compress.append(ext)
+    return do_not_compress
+
+
+def inspect_apk(apk_path: str) -> dict:
+    """
+    不反编译apk， 直接读取apk的文件列表和二进制的AndroidManifest.xml 获取apk的信息
+    :param apk_path: apk的路径
+    :return: {"package": , "minSdkVersion": , "targetSdkVersion": , "versionCode": , "versionName": ,
+              "doNotCompress": []}, 没有的字段为None
+    """
+    with zipfile.ZipFile(apk_path, "r") as apk_zip:
+        manifest = apk_zip.read("AndroidManifest.xml")
+        do_not_compress = apk_do_not_compress(apk_zip)
+
+    info = {"package": None, "minSdkVersion": None, "targetSdkVersion": None,
+            "versionCode": None, "versionName": None, "doNotCompress": do_not_compress}
+    # 引用了资源的属性（例如 versionName="@string/version"）， 之后从resources.arsc读取
+    references = {}
+
+    def value_of(attributes, resource_id, name, key):
+        value_type, value = get_attr(attributes, resource_id, name)
+        if value_type is None:
+            return
+        if value_type == TYPE_REFERENCE:
+            references[key] = value
+            return
+        info[key] = str(value)
+
+    for tag, attributes in iter_axml_elements(manifest):
+        if tag == "manifest":
+            value_of(attributes, 0, "package", "package")
+            value_of(attributes, ATTR_VERSION_CODE, "versionCode", "versionCode")
+            value_of(attributes, ATTR_VERSION_NAME, "versionName", "versionName")
+        elif tag == "uses-sdk":
+            value_of(attributes, ATTR_MIN_SDK_VERSION, "minSdkVersion", "minSdkVersion")
+            value_of(attributes, ATTR_TARGET_SDK_VERSION, "targetSdkVersion", "targetSdkVersion")
+            break
+        elif tag == "application":
+            # uses-sdk 在application前面
+            break
+    if references:
+        try:
+            with open_zip_entry(apk_path, "resources.arsc") as (buf, offset, size):
+                for key, resource_id in references.items():
+                    info[key] = resolve_resource_value(buf, offset, size, resource_id)
+        except KeyError:
+            raise ValueError(f"{', '.join(references)} 引用了资源， 但是apk里面没有resources.arsc")
+    if not info["package"]:
+        raise ValueError("AndroidManifest.xml 里面没有package")
+    return info
+
+
+@contextlib.contextmanager
+def open_zip_entry(zip_path: str, name: str):
+    """
+    读取zip里面的一个文件，没有压缩的文件直接使用mmap，不读取到内存
+    :param zip_path: zip的路径
+    :param name: 文件路径
+    :return: (buf, offset, size) 文件内容在buf的 [offset, offset + size)
+    """
+    with zipfile.ZipFile(zip_path, "r") as z:
+        info = z.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1 or info.file_size == 0:
+            data = z.read(info)
+            yield data, 0, len(data)
+            return
+        z.fp.seek(info.header_offset)
+        header = z.fp.read(zipfile.sizeFileHeader)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        offset = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+    with open(zip_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        yield buf, offset, info.file_size
+
+
+def iter_resource_ids(buf, offset: int, size: int):
+    """
+    流式解析resources.arsc， 按apktool的命名规则返回主package（0x7f）的所有资源:
+    同一个类型下重名的资源命名为 APKTOOL_DUPLICATE_类型_0x资源id，
+    typeSpec里面有但是没有任何配置的资源命名为 APKTOOL_DUMMY_序号
+    :param buf: resources.arsc 所在的buf
+    :param offset: resources.arsc 在buf里面的开始位置
+    :param size: resources.arsc 的大小
+    :return: 依次返回 (类型名, 资源名, 资源id)
+    """
+    chunk_type, header_size, table_size = struct.unpack_from("<HHI", buf, offset)
+    if chunk_type != RES_TABLE_TYPE:
+        raise ValueError("不是resources.arsc文件")
+    end = offset + min(size, table_size)
+    # 先找到主package
+    packages = []
+    chunk = offset + header_size
+    while chunk + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", buf, chunk)
+        if chunk_size < 8:
+            raise ValueError(f"resources.arsc chunk 大小错误: {chunk - offset}")
+        if chunk_type == RES_TABLE_PACKAGE_TYPE:
+            packages.append((struct.unpack_from("<I", buf, chunk + 8)[0], chunk))
+        chunk += chunk_size
+    if not packages:
+        return
+    package_id, package = next(filter(lambda x: x[0] == 0x7f, packages), packages[0])
+
+    _, package_header_size, package_size = struct.unpack_from("<HHI", buf, package)
+    type_strings_offset, _, key_strings_offset = struct.unpack_from("<III", buf, package + 268)
+    type_id_offset = struct.unpack_from("<I", buf, package + 284)[0] if package_header_size >= 288 else 0
+    type_strings = StringPool(buf, package + type_strings_offset)
+    key_strings = StringPool(buf, package + key_strings_offset)
+
+    # 每个类型: [类型名, 每个资源是否已经出现, 已经使用的名字]
+    types = {}
+    chunk = package + package_header_size
+    package_end = min(end, package + package_size)
+    while chunk + 8 <= package_end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", buf, chunk)
+        if chunk_size < 8:
+            raise ValueError(f"resources.arsc chunk 大小错误: {chunk - offset}")
+        if chunk_type == RES_TABLE_TYPE_SPEC_TYPE:
+            type_id = buf[chunk + 8]
+            entry_count = struct.unpack_from("<I", buf, chunk + 12)[0]
+            if type_id not in types:
+                types[type_id] = [type_strings.get(type_id - 1 - type_id_offset), bytearray(entry_count), set()]
+        elif chunk_type == RES_TABLE_TYPE_TYPE:
+            type_id, flags = buf[chunk + 8], buf[chunk + 9]
+            entry_count, entries_start = struct.unpack_from("<II", buf, chunk + 12)
+            type_name, seen, names = types.setdefault(
+                type_id, [type_strings.get(type_id - 1 - type_id_offset), bytearray(entry_count), set()])
+            for index, entry_offset in _iter_type_entries(buf, chunk + header_size, entry_count, flags):
+                if index >= len(seen):
+                    seen.extend(bytes(index + 1 - len(seen)))
+                if seen[index]:
+                    continue
+                seen[index] = 1
+                entry = chunk + entries_start + entry_offset
+                entry_size, entry_flags, key = struct.unpack_from("<HHI", buf, entry)
+                if entry_flags & ENTRY_FLAG_COMPACT:
+                    key = entry_size
+                resource_id = (package_id << 24) | (type_id << 16) | index
+                name = key_strings.get(key)
+                if name in names:
+                    name = f"APKTOOL_DUPLICATE_{type_name}_0x{resource_id:08x}"
+                elif not name:
+                    name = f"APKTOOL_DUMMYVAL_0x{resource_id:08x}"
+                names.add(name)
+                yield type_name, name, resource_id
+        chunk += chunk_size
+
+    for type_id, (type_name, seen, _) in types.items():
+        for index in range(len(seen)):
+            if not seen[index]:
+                yield type_name, f"APKTOOL_DUMMY_{index:x}", (package_id << 24) | (type_id << 16) | index
+
+
+def resolve_resource_value(buf, offset: int, size: int, resource_id: int, depth: int = 0) -> str:
+    """
+    从resources.arsc读取资源的值（和 aapt2 dump badging 一样使用默认配置， 没有默认配置的时候使用第一个配置）
+    :param buf: resources.arsc 所在的buf
+    :param offset: resources.arsc 在buf里面的开始位置
+    :param size: resources.arsc 的大小
+    :param resource_id: 资源id
+    :param depth: 引用的层数， 避免循环引用
+    :return: 字符串形式的值
+    """
+    chunk_type, header_size, table_size = struct.unpack_from("<HHI", buf, offset)
+    if chunk_type != RES_TABLE_TYPE:
+        raise ValueError("不是resources.arsc文件")
+    end = offset + min(size, table_size)
+    package_id, type_id, index = resource_id >> 24, (resource_id >> 16) & 0xff, resource_id & 0xffff
+    strings = None
+    package = None
+    chunk = offset + header_size
+    while chunk + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", buf, chunk)
+        if chunk_size < 8:
+            raise ValueError(f"resources.arsc chunk 大小错误: {chunk - offset}")
+        if chunk_type == RES_STRING_POOL_TYPE and strings is None:
+            strings = StringPool(buf, chunk)
+        elif chunk_type == RES_TABLE_PACKAGE_TYPE and struct.unpack_from("<I", buf, chunk + 8)[0] == package_id:
+            package = chunk
+        chunk += chunk_size
+    if package is None:
+        raise ValueError(f"resources.arsc 里面没有资源 0x{resource_id:08x}")
+
+    # (值的类型, 值)， 默认配置的优先
+    found = None
+    _, package_header_size, package_size = struct.unpack_from("<HHI", buf, package)
+    chunk = package + package_header_size
+    package_end = min(end, package + package_size)
+    while chunk + 8 <= package_end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", buf, chunk)
+        if chunk_size < 8:
+            raise ValueError(f"resources.arsc chunk 大小错误: {chunk - offset}")
+        if chunk_type == RES_TABLE_TYPE_TYPE and buf[chunk + 8] == type_id:
+            flags = buf[chunk + 9]
+            entry_count, entries_start = struct.unpack_from("<II", buf, chunk + 12)
+            # ResTable_config 除了size之外都是0的是默认配置
+            config_size = struct.unpack_from("<I", buf, chunk + 20)[0]
+            is_default = not any(buf[chunk + 24:chunk + 20 + config_size])
+            value = None
+            for entry_index, entry_offset in _iter_type_entries(buf, chunk + header_size, entry_count, flags):
+                if entry_index != index:
+                    continue
+                entry = chunk + entries_start + entry_offset
+                entry_size, entry_flags, data = struct.unpack_from("<HHI", buf, entry)
+                if entry_flags & ENTRY_FLAG_COMPACT:
+                    value = (entry_flags >> 8, data)
+                elif not entry_flags & ENTRY_FLAG_COMPLEX:
+                    # Res_value: size, res0, dataType, data
+                    value = struct.unpack_from("<BI", buf, entry + entry_size + 3)
+                break
+            if value is not None and (is_default or found is None):
+                found = value
+                if is_default:
+                    break
+        chunk += chunk_size
+    if found is None:
+        raise ValueError(f"resources.arsc 里面没有资源 0x{resource_id:08x} 的值")
+
+    value_type, value = found
+    if value_type == TYPE_REFERENCE:
+        if depth >= 8:
+            raise ValueError(f"资源 0x{resource_id:08x} 的引用层数太多")
+        return resolve_resource_value(buf, offset, size, value, depth + 1)
+    if value_type == TYPE_STRING:
+        if strings is None:
+            raise ValueError("resources.arsc 里面没有字符串池")
+        return strings.get(value)
+    if value_type == TYPE_INT_DEC:
+        return str(struct.unpack("<i", struct.pack("<I", value))[0])
+    return str(value)
+
+
+def _iter_type_entries(buf, offset: int, entry_count: int, flags: int):
+    """
+    ResTable_type 的entry偏移表， 返回 (资源序号, entry的偏移)
+    """
+    if flags & TYPE_FLAG_SPARSE:
+        for i in range(entry_count):
+            index, entry_offset = struct.unpack_from("<HH", buf, offset + i * 4)
+            yield index, entry_offset * 4
+    elif flags & TYPE_FLAG_OFFSET16:
+        for index, entry_offset in enumerate(struct.unpack_from(f"<{entry_count}H", buf, offset)):
+            if entry_offset != 0xffff:
+                yield index, entry_offset * 4
+    else:
+        for index, entry_offset in enumerate(struct.unpack_from(f"<{entry_count}I", buf, offset)):
+            if entry_offset != 0xffffffff:
+                yield index, entry_offset
+
+
+def write_public_ids(apk_path: str, public_path: str, package_name: str) -> int:
+    """
+    直接从apk的resources.arsc 生成aapt2 --stable-ids 使用的 public.txt
+    :param apk_path: apk的路径
+    :param public_path: 输出的public.txt
+    :param package_name: apk的包名
+    :return: 资源的数量
+    """
+    count = 0
+    with open_zip_entry(apk_path, "resources.arsc") as (buf, offset, size), \
+            open(public_path, "w", encoding="UTF-8") as f:
+        for type_name, name, resource_id in iter_resource_ids(buf, offset, size):
+            f.write(f"{package_name}:{type_name}/{name} = 0x{resource_id:08x}\n")
+            count += 1
+    return count
@@ -0,0 +1,389 @@
+# coding=utf-8
+"""
+Copyright (C) 2021 37手游安卓团队
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import fnmatch
+import glob
+import json
+import os
+import re
+import sys
+
+if hasattr(sys, "_flask"):
+    from .manifest_proto import DELIVERY_MODES
+else:
+    try:
+        from manifest_proto import DELIVERY_MODES
+    except:
+        from .manifest_proto import DELIVERY_MODES
+
+# 只使用 --pad_reg 的时候生成的asset pack
+PAD_REG_PACK_NAME = "pad_sy"
+
+# 一条规则支持的条件， 同一条规则的条件都满足才算匹配
+RULE_KEYS = ("regex", "glob", "prefix", "paths", "min_size", "max_size")
+
+# module的名字只能使用字母，数字和下划线
+PACK_NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+
+class AssetRule:
+    """
+    把assets里面的文件分配到asset pack的一条规则， 路径是assets下面的相对路径（例如 a/b.map）
+    """
+
+    def __init__(self, pack: str, regex: str = None, glob: str = None, prefix: str = None, paths: list = None,
+                 min_size: int = None, max_size: int = None):
+        """
+        :param pack: 匹配到的文件放到哪个asset pack
+        :param regex: 正则表达式， 从路径的开头匹配（和 --pad_reg 一样）
+        :param glob: 通配符， 匹配整个路径（* 也可以匹配 /）
+        :param prefix: 路径的前缀
+        :param paths: 完整路径的列表， 用集合查找（自动分配asset pack的时候生成）
+        :param min_size: 文件大小（字节， 未压缩）的下限， 包括这个值
+        :param max_size: 文件大小的上限， 包括这个值
+        """
+        self.pack = pack
+        self.regex = regex
+        self.glob = glob
+        self.prefix = prefix
+        if paths is not None and not isinstance(paths, (list, tuple)):
+            raise TypeError(f"paths 必须是路径的列表: {paths}")
+        self.paths = list(paths) if paths is not None else None
+        self.path_set = frozenset(self.paths) if self.paths is not None else None
+        self.min_size = min_size
+        self.max_size = max_size
+        # 每个条件单独编译， 用来逐条匹配
+        self.regex_pattern = re.compile(regex) if regex else None
+        self.glob_pattern = re.compile(fnmatch.translate(glob)) if glob else None
+        # 路径的条件合并成一个从开头匹配的正则， 每个条件一个零宽断言， 用来和其他规则合并。
+        # 正则使用了分组（合并之后分组的序号会变化， 反向引用会失效）或者全局的内联标记（例如 (?i)， 只能写在开头）
+        # 的时候不能合并， 为None
+        self.path_regex = ""
+        if prefix:
+            self.path_regex += f"(?={re.escape(prefix)})"
+        if regex:
+            self.path_regex += f"(?=(?:{regex}))"
+        if glob:
+            self.path_regex += f"(?={fnmatch.translate(glob)})"
+        default_flags = re.compile("").flags
+        for pattern in (self.regex_pattern, self.glob_pattern):
+            if pattern is not None and (pattern.groups or pattern.flags != default_flags):
+                self.path_regex = None
+
+    def path_match(self, path: str) -> bool:
+        if self.path_set is not None and path not in self.path_set:
+            return False
+        if self.prefix and not path.startswith(self.prefix):
+            return False
+        if self.regex_pattern is not None and not self.regex_pattern.match(path):
+            return False
+        return self.glob_pattern is None or bool(self.glob_pattern.match(path))
+
+    def size_match(self, size: int) -> bool:
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return True
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, key) for key in RULE_KEYS if getattr(self, key) is not None}
+
+
+class AssetRules:
+    """
+    asset pack的分配规则， 规则文件（json）:
+    {
+      "packs": [
+        {"name": "maps", "delivery": "fast-follow",
+         "rules": [{"glob": "maps/*.map"}, {"prefix": "video/", "min_size": 1048576}]},
+        {"name": "dlc", "delivery": "on-demand", "rules": [{"regex": "dlc_\\\\d+/"}]}
+      ]
+    }
+    一个文件按顺序使用第一条匹配的规则， 没有匹配的规则的文件留在base里面。
+    paths 规则和只有目录前缀（/ 结尾）的规则用字典查找， 其他的规则合并成一个正则， 每个文件只需要匹配一次
+    """
+
+    def __init__(self, packs: list = None):
+        """
+        :param packs: [{"name": "", "delivery": "", "rules": [{}]}]
+        """
+        # [(名字, 分发方式)]
+        self.packs = []
+        self.rules = []
+        self._pattern = None
+        self._index = None
+        for pack in packs or []:
+            self.add_pack(pack)
+
+    @staticmethod
+    def load(rules_path: str = None, pad_reg: str = ""):
+        """
+        :param rules_path: 规则文件的路径
+        :param pad_reg: 兼容 --pad_reg， 匹配的文件放到 pad_sy（install-time）， 在规则文件的规则之后匹配
+        """
+        packs = []
+        if rules_path:
+            with open(rules_path, "r", encoding="UTF-8") as f:
+                packs = json.load(f).get("packs", [])
+        rules = AssetRules(packs)
+        if pad_reg:
+            rules.add_pack({"name": PAD_REG_PACK_NAME, "delivery": "install-time", "rules": [{"regex": pad_reg}]})
+        return rules
+
+    def add_pack(self, pack: dict):
+        name = pack.get("name", "")
+        delivery = pack.get("delivery", "install-time")
+        if not PACK_NAME_PATTERN.match(name) or name == "base":
+            raise ValueError(f"asset pack的名字 {name} 不合法， 只能使用字母，数字和下划线， 不能是base")
+        if name in self.names():
+            raise ValueError(f"asset pack {name} 重复")
+        if delivery not in DELIVERY_MODES:
+            raise ValueError(f"asset pack {name} 不支持的分发方式 {delivery}， 可选: {', '.join(DELIVERY_MODES)}")
+        self.packs.append((name, delivery))
+        for rule in pack.get("rules", []):
+            unknown = set(rule) - set(RULE_KEYS)
+            if unknown or not rule:
+                raise ValueError(f"asset pack {name} 的规则 {rule} 不合法， 支持的条件: {', '.join(RULE_KEYS)}")
+            try:
+                self.rules.append(AssetRule(name, **rule))
+            except re.error as e:
+                raise ValueError(f"asset pack {name} 的规则 {rule} 正则表达式错误 {str(e)}")
+            except TypeError as e:
+                raise ValueError(f"asset pack {name} 的规则 {rule} 不合法 {str(e)}")
+        self._pattern = None
+        self._index = None
+
+    def names(self) -> list:
+        return [name for name, _ in self.packs]
+
+    def delivery(self, name: str) -> str:
+        return dict(self.packs)[name]
+
+    def __bool__(self):
+        return bool(self.packs)
+
+    def as_dict(self) -> dict:
+        return {"packs": [{"name": name, "delivery": delivery,
+                           "rules": [rule.as_dict() for rule in self.rules if rule.pack == name]}
+                          for name, delivery in self.packs]}
+
+    def index(self):
+        """
+        :return: ({完整路径: 规则的序号}, {目录前缀: 规则的序号}, [合并成一个正则的规则的序号], [逐条匹配的规则的序号])，
+                 相同的key记录第一条规则。 paths 和其他路径条件一起使用的规则， 以及正则不能合并的规则需要逐条匹配
+        """
+        if self._index is None:
+            exact = {}
+            prefixes = {}
+            combined = []
+            singles = []
+            for i, rule in enumerate(self.rules):
+                if rule.path_set is not None:
+                    if rule.prefix or rule.regex or rule.glob:
+                        singles.append(i)
+                    else:
+                        for path in rule.path_set:
+                            exact.setdefault(path, i)
+                elif rule.prefix and rule.prefix.endswith("/") and not rule.regex and not rule.glob:
+                    prefixes.setdefault(rule.prefix, i)
+                elif rule.path_regex is None:
+                    singles.append(i)
+                else:
+                    combined.append(i)
+            self._index = (exact, prefixes, combined, singles)
+        return self._index
+
+    def pattern(self):
+        """
+        不能用字典查找的规则合并成的正则， 命名分组 r{规则的序号}， 匹配结果是第一条路径条件满足的规则。
+        不能合并的时候返回None， 按顺序逐条匹配
+        """
+        combined = self.index()[2]
+        if self._pattern is None:
+            try:
+                self._pattern = re.compile("|".join(f"(?P<r{i}>{self.rules[i].path_regex})" for i in combined))
+            except re.error:
+                self._pattern = False
+        return self._pattern or None
+
+    def match(self, path: str, size: int):
+        """
+        :param path: assets下面的相对路径
+        :param size: 文件的大小
+        :return: asset pack的名字， 没有匹配的规则返回None
+        """
+        if not self.rules:
+            return None
+        exact, prefixes, combined, singles = self.index()
+        # 路径条件满足的第一条规则
+        first = exact.get(path, len(self.rules))
+        if prefixes:
+            end = path.find("/")
+            while end >= 0:
+                first = min(first, prefixes.get(path[:end + 1], first))
+                end = path.find("/", end + 1)
+        if combined:
+            pattern = self.pattern()
+            if pattern is not None:
+                m = pattern.match(path)
+                if m:
+                    first = min(first, int(m.lastgroup[1:]))
+            else:
+                singles = sorted(singles + combined)
+        for i in singles:
+            if i >= first:
+                break
+            if self.rules[i].path_match(path):
+                first = i
+                break
+        if first == len(self.rules):
+            return None
+        if self.rules[first].size_match(size):
+            return self.rules[first].pack
+        # 第一条规则的大小条件不满足， 继续检查后面的规则
+        for rule in self.rules[first + 1:]:
+            if rule.path_match(path) and rule.size_match(size):
+                return rule.pack
+        return None
+
+    def route(self, files) -> dict:
+        """
+        把文件分配到asset pack
+        :param files: [(assets下面的相对路径, 大小)]
+        :return: {asset pack的名字: [assets下面的相对路径]}， 包含所有的asset pack
+        """
+        routes = {name: [] for name in self.names()}
+        for path, size in files:
+            name = self.match(path, size)
+            if name:
+                routes[name].append(path)
+        return routes
+
+
+# 自动分配asset pack的时候的分组方式: dir 按目录（超过大小的目录再按下一级目录拆分）; ext 按文件扩展名
+PARTITION_GROUPS = ("dir", "ext")
+
+
+def _paths_groups(files, max_size: int) -> list:
+    """
+    :param files: [(assets下面的相对路径, 大小)]
+    :return: 总大小不超过max_size的时候是一个分组， 否则每个文件一个分组 [(规则, 大小)]
+    """
+    total = sum(size for _, size in files)
+    if total <= max_size:
+        return [({"paths": sorted(path for path, _ in files)}, total)]
+    return [({"paths": [path]}, size) for path, size in sorted(files)]
+
+
+def _dir_groups(files, prefix: str, max_size: int) -> list:
+    """
+    按目录分组， 目录的总大小超过max_size的时候按下一级目录拆分
+    :param files: [(prefix下面的相对路径, 大小)]
+    :return: [(规则, 大小)]
+    """
+    children = {}
+    direct = []
+    for path, size in files:
+        if "/" in path:
+            name, rest = path.split("/", 1)
+            children.setdefault(name, []).append((rest, size))
+        else:
+            direct.append((path, size))
+    groups = []
+    for name in sorted(children):
+        total = sum(size for _, size in children[name])
+        if total <= max_size:
+            groups.append(({"prefix": f"{prefix}{name}/"}, total))
+        else:
+            groups.extend(_dir_groups(children[name], f"{prefix}{name}/", max_size))
+    total = sum(size for _, size in direct)
+    if total <= max_size:
+        if direct:
+            groups.append(({"regex": f"{re.escape(prefix)}[^/]*$"}, total))
+    else:
+        groups.extend(_paths_groups([(prefix + path, size) for path, size in direct], max_size))
+    return groups
+
+
+def _ext_groups(files, max_size: int) -> list:
+    """
+    按扩展名分组， 一个扩展名的总大小超过max_size的时候按目录拆分， 目录还是超过的时候再按文件拆分
+    :param files: [(assets下面的相对路径, 大小)]
+    :return: [(规则, 大小)]
+    """
+    exts = {}
+    for path, size in files:
+        ext = os.path.splitext(path.rsplit("/", 1)[-1])[1]
+        exts.setdefault(ext, []).append((path, size))
+    groups = []
+    for ext in sorted(exts):
+        total = sum(size for _, size in exts[ext])
+        if total > max_size:
+            dirs = {}
+            for path, size in exts[ext]:
+                dirs.setdefault(path.rsplit("/", 1)[0] if "/" in path else "", []).append((path, size))
+            for name in sorted(dirs):
+                groups.extend(_paths_groups(dirs[name], max_size))
+        elif ext:
+            groups.append(({"glob": f"*{glob.escape(ext)}"}, total))
+        else:
+            # 没有扩展名的文件（文件名开头的 . 不算扩展名）
+            groups.append(({"regex": r"(?:.*/)?\.*[^./]*$"}, total))
+    return groups
+
+
+def partition_assets(files, max_pack_size: int, group_by: str = "dir", delivery: str = "install-time",
+                     name_prefix: str = "pad_", exclude_names=()) -> list:
+    """
+    把assets按分组装箱（first-fit decreasing）到尽量少的asset pack， 每个asset pack不超过max_pack_size，
+    同一个分组（目录或者扩展名）的文件放在同一个asset pack里面。
+    单个文件超过max_pack_size的时候单独一个asset pack
+    :param files: [(assets下面的相对路径, 大小)]
+    :param max_pack_size: asset pack的大小上限（字节， 未压缩）
+    :param group_by: dir 或者 ext
+    :param delivery: asset pack的分发方式
+    :param name_prefix: asset pack名字的前缀， 后面加上序号
+    :param exclude_names: 已经使用的asset pack的名字
+    :return: 规则文件格式的asset pack列表 [{"name": "", "delivery": "", "size": 0, "rules": [{}]}]
+    """
+    if group_by not in PARTITION_GROUPS:
+        raise ValueError(f"不支持的分组方式 {group_by}， 可选: {', '.join(PARTITION_GROUPS)}")
+    if max_pack_size <= 0:
+        raise ValueError(f"asset pack的大小上限必须大于0: {max_pack_size}")
+    files = list(files)
+    groups = _dir_groups(files, "", max_pack_size) if group_by == "dir" else _ext_groups(files, max_pack_size)
+    # [[大小, [规则]]]
+    bins = []
+    for rule, size in sorted(groups, key=lambda x: -x[1]):
+        for pack_bin in bins:
+            if pack_bin[0] + size <= max_pack_size:
+                pack_bin[0] += size
+                pack_bin[1].append(rule)
+                break
+        else:
+            bins.append([size, [rule]])
+    packs = []
+    index = 0
+    for size, rules in bins:
+        while f"{name_prefix}{index}" in exclude_names:
+            index += 1
+        # 同一个asset pack的 paths 规则合并成一条（不同分组的文件不会重复， 顺序没有关系）
+        paths = sorted(path for rule in rules if "paths" in rule for path in rule["paths"])
+        rules = [rule for rule in rules if "paths" not in rule] + ([{"paths": paths}] if paths else [])
+        packs.append({"name": f"{name_prefix}{index}", "delivery": delivery, "size": size, "rules": rules})
+        index += 1
+    return packs
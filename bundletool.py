@@ -15,28 +15,58 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import datetime
+import hashlib
 import json
 import re
 import yaml
 import argparse
+import queue
+import subprocess
+import threading
 import time
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+
 import xml.etree.ElementTree as ET
 
 from files_pb2 import Assets
-from google.protobuf import json_format
 
 if hasattr(sys, "_flask"):
     from .utils import *
+    from .apk_parser import inspect_apk, write_public_ids
+    from . import signer
+    from .pipeline import Pipeline
+    from .manifest_proto import asset_pack_manifest
+    from .asset_rules import AssetRules, partition_assets, PARTITION_GROUPS
 else:
     try:
         from utils import *
+        from apk_parser import inspect_apk, write_public_ids
+        import signer
+        from pipeline import Pipeline
+        from manifest_proto import asset_pack_manifest
+        from asset_rules import AssetRules, partition_assets, PARTITION_GROUPS
     except:
         from .utils import *
+        from .apk_parser import inspect_apk, write_public_ids
+        from . import signer
+        from .pipeline import Pipeline
+        from .manifest_proto import asset_pack_manifest
+        from .asset_rules import AssetRules, partition_assets, PARTITION_GROUPS
+
+
+global_print_fun = None
+# 并行执行的任务先把日志写到当前线程的缓存里面，任务结束后一起输出，同一个任务的日志不会和其他任务混在一起
+_log_local = threading.local()
+_log_lock = threading.Lock()
 
 
 def print_log(message):
+    log_buffer = getattr(_log_local, "buffer", None)
+    if log_buffer is not None:
+        log_buffer.append(message)
+        return
     if global_print_fun:
         global_print_fun(message)
     else:
@@ -62,51 +92,659 @@ STORE_PASSWORD = "luojian37"
 KEY_ALIAS = "luojian37"
 KEY_PASSWORD = "luojian37"
 
-BUNDLE_MODULE_TEMPLATE_PATH = os.path.join(get_base_dir(), "tools", "pad_template")
+JVM_WORKER_SOURCE_PATH = os.path.join(get_base_dir(), "tools", "jvm_worker", "JarWorker.java")
+
+# 缓存的默认大小上限
+COMPILE_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+DECODE_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+AAB_CACHE_SIZE = 20 * 1024 * 1024 * 1024
+# 构建流程或者BundleConfig有变化的时候修改，让之前缓存的aab失效
+AAB_CACHE_VERSION = 1
+CDS_CACHE_SIZE = 1024 * 1024 * 1024
+# 常驻jvm执行多少条命令之后重启， 避免jar里面的静态变量，内存一直累积
+JVM_WORKER_MAX_RUNS = 50
+
+# java -jar 的启动参数， heap_factor: 最大堆内存为apk大小的倍数， 限制在 min_heap 到 max_heap 之间（MB）
+JVM_PROFILES = {
+    # 不添加任何参数，使用jvm的默认值
+    "default": {"options": []},
+    # 只使用C1编译，适合apk比较小，命令执行时间短的情况
+    "fast": {"options": ["-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC", "-XX:-UsePerfData"],
+             "heap_factor": 8, "min_heap": 512, "max_heap": 4096},
+    # 完整的分层编译和并行GC，适合大的apk
+    "throughput": {"options": ["-XX:+UseParallelGC", "-XX:-UsePerfData"],
+                   "heap_factor": 16, "min_heap": 1024, "max_heap": 8192},
+}
 
 
 def task(task_name, fun, *args, **kwargs):
     print_log(f"---{task_name}")
     start_time = time.time()
-    status, msg = fun(*args, **kwargs)
+    with cmd_scope() as cmd_results:
+        status, msg = fun(*args, **kwargs)
     end_time = time.time()
+    for cmd_result in cmd_results:
+        print_log(f"   {cmd_result.summary()}")
     print_log(f"###耗时:{end_time - start_time} {task_name} status:{status} msg:{msg}")
     if status != 0:
         raise Exception(f"task {task_name} 执行异常status:{status} msg:{msg}")
 
 
-def compile_resources(compile_source_res_dir: str, compiled_resources: str, aapt2: str):
+def run_stage(stage, cancel_event: threading.Event):
+    """
+    Pipeline执行步骤: 步骤的日志在它结束之后一起输出， 并行的步骤的日志不会混在一起；
+    cancel_event set之后（其他步骤失败了）， 正在执行的外部命令会被结束
+    """
+    _log_local.buffer = []
+    try:
+        with cmd_scope(cancel_event=cancel_event):
+            task(stage.name, stage.fun, *stage.args)
+    finally:
+        log_buffer = _log_local.buffer
+        _log_local.buffer = None
+        with _log_lock:
+            for message in log_buffer:
+                print_log(message)
+
+
+class Aapt2Daemon:
+    """
+    aapt2 daemon 模式: 一个aapt2进程从stdin读取命令，每行一个参数，空行结束一条命令，
+    执行完成后在stderr输出 Done （失败的时候先输出 Error）
+    """
+
+    def __init__(self, aapt2: str):
+        self.aapt2 = aapt2
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.process = subprocess.Popen([self.aapt2, "daemon"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, universal_newlines=True, encoding="UTF-8",
+                                        errors="replace")
+        ready = self.process.stdout.readline().strip()
+        if ready != "Ready":
+            self.close()
+            raise Exception(f"aapt2 daemon 启动失败:{ready}")
+        # stdout 一般没有内容，读掉避免缓冲区满了阻塞aapt2
+        threading.Thread(target=self.process.stdout.read, daemon=True).start()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, args: list):
+        """
+        执行一条aapt2命令
+        :param args: aapt2的参数，例如 ["compile", "--legacy", "--dir", "res", "-o", "res.zip"]
+        :return: status, 输出信息
+        """
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+            result = CmdResult([self.aapt2] + list(args))
+            start_time = time.time()
+            # 超时或者取消的时候daemon会被结束， 读到EOF
+            with cmd_watchdog(self.process, result):
+                if not result.cancelled:
+                    try:
+                        result.status, result.stdout = self.read_result(args)
+                    except OSError as e:
+                        self.close()
+                        result.stderr = f"aapt2 daemon 异常退出 {str(e)}"
+            if result.timed_out or result.cancelled:
+                result.status = -1
+                result.stderr = "aapt2 daemon 执行超时" if result.timed_out else "aapt2 daemon 已取消"
+            result.wall_time = time.time() - start_time
+            record_cmd_result(result)
+            return result.status, result.output
+
+    def read_result(self, args: list):
+        """
+        发送一条命令， 读取到 Done 为止
+        """
+        self.process.stdin.write("\n".join(map(str, args)) + "\n\n")
+        self.process.stdin.flush()
+        status = 0
+        output = []
+        while True:
+            line = self.process.stderr.readline()
+            if not line:
+                # 进程退出了，下次重新启动
+                self.process = None
+                return -1, "aapt2 daemon 异常退出:" + "\n".join(output)
+            line = line.rstrip("\n")
+            if line == "Done":
+                break
+            if line == "Error":
+                status = 1
+                continue
+            output.append(line)
+        return status, "\n".join(output)
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write("quit\n\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        self.process = None
+
+
+class Aapt2DaemonPool:
+    """
+    aapt2 daemon 进程池， 每个并发的调用使用一个daemon，用完放回去给后面的调用复用
+    """
+
+    def __init__(self, aapt2: str):
+        self.aapt2 = aapt2
+        self.idle = queue.Queue()
+        self.daemons = []
+        self.lock = threading.Lock()
+
+    def execute(self, args: list):
+        try:
+            daemon = self.idle.get_nowait()
+        except queue.Empty:
+            daemon = Aapt2Daemon(self.aapt2)
+            with self.lock:
+                self.daemons.append(daemon)
+        try:
+            return daemon.execute(args)
+        finally:
+            self.idle.put(daemon)
+
+    def close(self):
+        with self.lock:
+            for daemon in self.daemons:
+                daemon.close()
+            self.daemons = []
+            self.idle = queue.Queue()
+
+
+def execute_aapt2(aapt2, args: list):
+    """
+    执行aapt2命令
+    :param aapt2: aapt2的路径，或者是 Aapt2DaemonPool
+    :param args: aapt2的参数
+    :return:
+    """
+    if isinstance(aapt2, Aapt2DaemonPool):
+        return aapt2.execute(args)
+    return execute_cmd([aapt2] + list(args))
+
+
+class JvmWorkerUnavailable(Exception):
+    """
+    常驻jvm启动失败，需要使用 java -jar 执行
+    """
+    pass
+
+
+class JvmWorker:
+    """
+    常驻的jvm进程（tools/jvm_worker/JarWorker.java）: 加载一次jar， 之后每条命令直接调用jar的main方法，
+    不用每次都启动jvm，加载类，JIT预热。协议和aapt2 daemon类似， 每行一个参数，空行结束一条命令，
+    执行完成后在stdout输出 "Done 退出码 输出的字节数" 和输出的内容
+    """
+
+    def __init__(self, java_cmd: list, jar: str):
+        self.java_cmd = java_cmd
+        self.jar = jar
+        self.process = None
+        self.runs = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        try:
+            self.process = subprocess.Popen(self.java_cmd + ["-cp", self.jar, JVM_WORKER_SOURCE_PATH, self.jar],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise JvmWorkerUnavailable(str(e))
+        ready = self.process.stdout.readline().decode("UTF-8", errors="replace").strip()
+        if ready != "Ready":
+            self.process.kill()
+            error = self.process.stderr.read().decode("UTF-8", errors="replace").strip()
+            self.process.wait()
+            self.process = None
+            raise JvmWorkerUnavailable(f"{ready} {error[-2000:]}")
+        self.runs = 0
+        # main方法的输出都转到了stdout，stderr只有jvm自己的警告，读掉避免缓冲区满了阻塞
+        threading.Thread(target=self.process.stderr.read, daemon=True).start()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, args: list):
+        """
+        执行一条命令
+        :param args: jar的参数，例如 ["d", "xxx.apk", "-s", "-o", "out"]
+        :return: status, 输出信息
+        """
+        with self.lock:
+            if self.runs >= JVM_WORKER_MAX_RUNS:
+                self.close()
+            if not self.is_alive():
+                self.start()
+            self.runs += 1
+            result = CmdResult(["java", "-jar", self.jar] + list(args))
+            start_time = time.time()
+            # 超时或者取消的时候jvm进程会被结束， 读到EOF
+            with cmd_watchdog(self.process, result):
+                if not result.cancelled:
+                    try:
+                        self.process.stdin.write(("\n".join(map(str, args)) + "\n\n").encode("UTF-8"))
+                        self.process.stdin.flush()
+                        line = self.process.stdout.readline().decode("UTF-8", errors="replace").split()
+                        if len(line) != 3 or line[0] != "Done":
+                            raise OSError(f"jvm worker 返回了异常的内容:{line}")
+                        result.status = int(line[1])
+                        result.stdout = self.process.stdout.read(int(line[2])).decode("UTF-8", errors="replace")
+                    except (OSError, ValueError) as e:
+                        # 执行到一半退出了，不能再用 java -jar 重新执行（输出目录可能已经有一部分文件）
+                        self.close()
+                        result.status = -1
+                        result.stderr = f"jvm worker 异常退出 {str(e)}"
+            if result.timed_out or result.cancelled:
+                result.status = -1
+                result.stderr = "jvm worker 执行超时" if result.timed_out else "jvm worker 已取消"
+            result.wall_time = time.time() - start_time
+            record_cmd_result(result)
+            return result.status, result.output
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write(b"quit\n\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        self.process = None
+
+
+class JvmWorkerPool:
+    """
+    常驻jvm进程池， 每个jar单独的进程，并发执行的时候启动多个
+    """
+
+    def __init__(self, java_cmd: list, jar: str):
+        self.java_cmd = java_cmd
+        self.jar = jar
+        self.idle = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def execute(self, args: list):
+        try:
+            worker = self.idle.get_nowait()
+        except queue.Empty:
+            worker = JvmWorker(self.java_cmd, self.jar)
+            with self.lock:
+                self.workers.append(worker)
+        try:
+            return worker.execute(args)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.close()
+            self.workers = []
+            self.idle = queue.Queue()
+
+
+class JavaLauncher:
+    """
+    生成 java -jar 的命令: 添加启动参数（JVM_PROFILES），以及每个jar的AppCDS归档。
+    归档不存在的时候这次执行使用 -XX:ArchiveClassesAtExit 生成（需要java 13以上），之后的执行使用
+    -XX:SharedArchiveFile 加载， 减少jvm启动和类加载的时间。
+    开启了jvm_worker的时候交给常驻的jvm进程执行（需要java 11以上，并且可以设置SecurityManager拦截System.exit），
+    常驻进程启动失败的话还是使用 java -jar
+    """
+
+    def __init__(self, profile: str = "default", cds_cache: FileCache = None, jvm_worker=False):
+        self.profile = JVM_PROFILES[profile]
+        self.cds_cache = cds_cache
+        self.jvm_worker = jvm_worker
+        # 每个jar的常驻进程池， 值为None的时候表示这个jar不能使用常驻进程
+        self.worker_pools = {}
+        self.lock = threading.Lock()
+        # 输入apk的大小，用来计算堆内存
+        self.input_size = 0
+        self._java_version = None
+
+    @property
+    def java_version(self):
+        """
+        :return: (主版本号， java -version 的输出)
+        """
+        if self._java_version is None:
+            try:
+                _, msg = execute_cmd(["java", "-version"])
+            except OSError:
+                msg = ""
+            self._java_version = self.parse_java_version(msg)
+        return self._java_version
+
+    @staticmethod
+    def parse_java_version(msg: str):
+        match = re.search(r'version "(\d+)(?:\.(\d+))?', msg)
+        major = 0
+        if match:
+            major = int(match.group(1))
+            if major == 1 and match.group(2):
+                # 1.8 -> 8
+                major = int(match.group(2))
+        return major, msg
+
+    def seed_java_version(self, version_output: str):
+        """
+        使用缓存的 java -version 输出， 不用再执行一次
+        """
+        if self._java_version is None and version_output:
+            self._java_version = self.parse_java_version(version_output)
+
+    def heap_size(self) -> int:
+        """
+        java进程大概占用的内存（字节）， 用于流水线的内存预算， 没有设置最大堆内存的时候按1GB计算
+        """
+        for option in reversed(self.options()):
+            if option.startswith("-Xmx") and option.endswith("m"):
+                return int(option[4:-1]) * 1024 * 1024
+        return 1024 * 1024 * 1024
+
+    def options(self) -> list:
+        options = list(self.profile["options"])
+        if "heap_factor" in self.profile and self.input_size > 0:
+            heap = self.input_size * self.profile["heap_factor"] // 1024 // 1024
+            heap = min(max(heap, self.profile["min_heap"]), self.profile["max_heap"])
+            options.append(f"-Xmx{heap}m")
+        return options
+
+    def cds_key(self, jar: str) -> str:
+        # 归档和jar, jvm的版本, gc等参数绑定
+        return hashlib.sha256(f"{file_sha256(jar)}\0{self.java_version[1]}\0{' '.join(self.profile['options'])}"
+                              .encode("UTF-8")).hexdigest()
+
+    def execute(self, jar: str, args: list, dump=True):
+        """
+        执行 java -jar
+        :param jar: jar的路径
+        :param args: jar的参数
+        :param dump: 没有归档的时候是否生成， 只是查看版本号的命令加载的类太少，不生成
+        :return:
+        """
+        pool = self.worker_pool(jar)
+        if pool:
+            try:
+                return pool.execute(args)
+            except JvmWorkerUnavailable as e:
+                print_log(f"[jvm worker]:{os.path.basename(jar)} 启动失败，使用java -jar执行 {str(e)}")
+                with self.lock:
+                    self.worker_pools[jar] = None
+                pool.close()
+        cmd = ["java"] + self.options()
+        dump_path = None
+        if self.cds_cache and self.java_version[0] >= 13:
+            key = self.cds_key(jar)
+            archive_path = self.cds_cache.get(key)
+            if archive_path:
+                cmd.append(f"-XX:SharedArchiveFile={archive_path}")
+            elif dump:
+                dump_path = f"{self.cds_cache.path(key)}.{os.getpid()}.{threading.get_ident()}.jsa.tmp"
+                os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+                cmd.append(f"-XX:ArchiveClassesAtExit={dump_path}")
+        status, msg = execute_cmd(cmd + ["-jar", jar] + list(args))
+        if dump_path and os.path.exists(dump_path):
+            if status == 0:
+                self.cds_cache.put(key, dump_path, link=True)
+                self.cds_cache.evict()
+            os.remove(dump_path)
+        return status, msg
+
+    def worker_pool(self, jar: str):
+        """
+        :return: jar的常驻进程池， 不使用常驻进程的时候返回None
+        """
+        if not self.jvm_worker:
+            return None
+        with self.lock:
+            if jar not in self.worker_pools:
+                pool = None
+                if self.java_version[0] >= 11:
+                    java_cmd = ["java"] + self.options()
+                    if self.java_version[0] >= 12:
+                        # java 18 以上默认不允许设置SecurityManager
+                        java_cmd.append("-Djava.security.manager=allow")
+                    pool = JvmWorkerPool(java_cmd, jar)
+                else:
+                    print_log("[jvm worker]:需要java 11以上，使用java -jar执行")
+                self.worker_pools[jar] = pool
+            return self.worker_pools[jar]
+
+    def close(self):
+        with self.lock:
+            for pool in filter(None, self.worker_pools.values()):
+                pool.close()
+            self.worker_pools = {}
+
+
+def execute_java(java, jar: str, args: list, dump=True):
+    """
+    执行 java -jar
+    :param java: JavaLauncher， None的时候直接执行 java -jar
+    :param jar: jar的路径
+    :param args: jar的参数
+    :param dump: 是否生成AppCDS归档
+    :return:
+    """
+    if isinstance(java, JavaLauncher):
+        return java.execute(jar, args, dump)
+    return execute_cmd(["java", "-jar", jar] + list(args))
+
+
+def compile_resources(compile_source_res_dir: str, compiled_resources: str, aapt2):
     """
     编译 res目录
     :param compile_source_res_dir: res文件夹的路径
     :param compiled_resources: 输出的路径
-    :param aapt2: aapt2
+    :param aapt2: aapt2的路径，或者是 Aapt2DaemonPool
     :return:
     """
-    cmd = f"{aapt2} compile --legacy\
-        --dir {compile_source_res_dir} \
-        -o {compiled_resources} "
-    return execute_cmd(cmd)
+    args = ["compile", "--legacy",
+            "--dir", compile_source_res_dir,
+            "-o", compiled_resources]
+    return execute_aapt2(aapt2, args)
 
 
-def link_asset_resources(link_out_apk_path: str,
-                         input_manifest: str,
-                         android: str,
-                         aapt2: str):
+def split_resources(compile_source_res_dir: str, shard_root_dir: str, shard_count: int) -> list:
     """
-    生成一个apk
-    :param link_out_apk_path: 生成临时apk的路径
-    :param input_manifest: 需要的manifest的路径
-    :param android: android的jar
+    按资源目录（values, drawable-xhdpi ...）把res分成多份，每份的文件数量尽量接近，
+    文件使用硬链接，不拷贝数据
+    :param compile_source_res_dir: res文件夹的路径
+    :param shard_root_dir: 存放分片的目录
+    :param shard_count: 分片的数量
+    :return: 分片后的res文件夹列表
+    """
+    type_dirs = []
+    for entry in os.scandir(compile_source_res_dir):
+        if entry.is_dir():
+            files = [f.name for f in os.scandir(entry.path) if f.is_file()]
+            type_dirs.append((entry.name, files))
+    # 文件多的目录先分配，每次分配给文件最少的分片
+    type_dirs.sort(key=lambda x: len(x[1]), reverse=True)
+    shards = [[0, []] for _ in range(min(shard_count, len(type_dirs)))]
+    for type_dir in type_dirs:
+        shard = min(shards, key=lambda x: x[0])
+        shard[0] += len(type_dir[1])
+        shard[1].append(type_dir)
+
+    shard_dirs = []
+    for index, (_, shard_type_dirs) in enumerate(shards):
+        shard_dir = os.path.join(shard_root_dir, str(index))
+        for type_name, files in shard_type_dirs:
+            os.makedirs(os.path.join(shard_dir, type_name))
+            for f in files:
+                link_or_copy(os.path.join(compile_source_res_dir, type_name, f), os.path.join(shard_dir, type_name, f))
+        shard_dirs.append(shard_dir)
+    return shard_dirs
+
+
+def compile_resources_parallel(compile_source_res_dir: str, compiled_resources: str, aapt2, workers: int,
+                               compiled_resources_list: list):
+    """
+    把res分片之后，多个aapt2并行编译，每个分片生成一个zip，关联的时候作为多个 -R 输入
+    :param compile_source_res_dir: res文件夹的路径
+    :param compiled_resources: 输出的路径， 分片输出为 xxx_0.zip, xxx_1.zip ...
+    :param aapt2: aapt2的路径，或者是 Aapt2DaemonPool
+    :param workers: 并行编译的数量
+    :param compiled_resources_list: 记录编译成功的zip文件
+    :return:
+    """
+    name, ext = os.path.splitext(compiled_resources)
+    shard_dirs = split_resources(compile_source_res_dir, name + "_shards", workers)
+    shard_outputs = list(map(lambda x: f"{name}_{x}{ext}", range(len(shard_dirs))))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(bind_cmd_scope(lambda x: compile_resources(x[0], x[1], aapt2)),
+                                    zip(shard_dirs, shard_outputs)))
+    compiled_resources_list.extend(filter(os.path.exists, shard_outputs))
+    for status, msg in results:
+        if status != 0:
+            return status, msg
+    return 0, "success"
+
+
+def get_aapt2_version(aapt2: str) -> str:
+    """
+    aapt2的版本信息，用来做编译缓存的key
     :param aapt2: aapt2的路径
     :return:
     """
-    cmd = f"{aapt2} link --proto-format \
-        -o {link_out_apk_path} \
-        -I {android} \
-        --manifest {input_manifest} \
-        --auto-add-overlay"
-    return execute_cmd(cmd)
+    try:
+        status, msg = execute_cmd([aapt2, "version"])
+        if status == 0:
+            return msg
+    except OSError:
+        pass
+    stat = os.stat(aapt2)
+    return f"{aapt2}:{stat.st_size}:{stat.st_mtime}"
+
+
+def flat_file_name(resource_path: str) -> str:
+    """
+    aapt2 compile 输出的文件名， 例如 drawable-hdpi/icon.png -> drawable-hdpi_icon.png.flat,
+    values/strings.xml -> values_strings.arsc.flat
+    :param resource_path: 资源目录/文件名
+    :return:
+    """
+    type_dir, file_name = resource_path.split("/")
+    if type_dir == "values" or type_dir.startswith("values-"):
+        file_name = os.path.splitext(file_name)[0] + ".arsc"
+    return f"{type_dir}_{file_name}.flat"
+
+
+def compile_resources_cached(compile_source_res_dir: str, compiled_resources: str, aapt2, cache: FileCache,
+                             aapt2_version: str, workers: int = 1):
+    """
+    带缓存的编译res: 每个资源文件按 内容hash + 资源路径 + aapt2版本 缓存编译后的.flat文件，
+    只编译没有缓存的文件，最后把所有的.flat文件打包成zip给link使用
+    :param compile_source_res_dir: res文件夹的路径
+    :param compiled_resources: 输出的zip的路径
+    :param aapt2: aapt2的路径，或者是 Aapt2DaemonPool
+    :param cache: .flat文件的缓存
+    :param aapt2_version: aapt2的版本
+    :param workers: 并行编译的数量
+    :return:
+    """
+    resource_files = []
+    for type_entry in os.scandir(compile_source_res_dir):
+        if not type_entry.is_dir():
+            continue
+        for entry in os.scandir(type_entry.path):
+            if entry.is_file():
+                resource_files.append((f"{type_entry.name}/{entry.name}", entry.path))
+
+    def cache_key(resource_file):
+        h = hashlib.sha256(f"{aapt2_version}\0--legacy\0{resource_file[0]}\0".encode("UTF-8"))
+        with open(resource_file[1], "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        keys = list(executor.map(cache_key, resource_files))
+        hits = []
+        misses = []
+        for resource_file, key in zip(resource_files, keys):
+            cache_path = cache.get(key)
+            if cache_path:
+                hits.append((resource_file[0], cache_path))
+            else:
+                misses.append((resource_file[0], resource_file[1], key))
+
+        # 没有缓存的文件分批编译, 每批输出到一个目录
+        flat_dir = os.path.splitext(compiled_resources)[0] + "_flat"
+        batches = [misses[i:i + 500] for i in range(0, len(misses), 500)]
+        batch_dirs = list(map(lambda x: os.path.join(flat_dir, str(x)), range(len(batches))))
+        for batch_dir in batch_dirs:
+            os.makedirs(batch_dir)
+        results = list(executor.map(bind_cmd_scope(
+            lambda x: execute_aapt2(aapt2, ["compile", "--legacy", "-o", x[1]] + list(map(lambda m: m[1], x[0])))),
+            zip(batches, batch_dirs)))
+
+    for batch, batch_dir in zip(batches, batch_dirs):
+        for resource_path, _, key in batch:
+            flat_path = os.path.join(batch_dir, flat_file_name(resource_path))
+            if os.path.exists(flat_path):
+                cache.put(key, flat_path)
+
+    with zipfile.ZipFile(compiled_resources, "w", zipfile.ZIP_STORED) as out_zip:
+        for resource_path, cache_path in hits:
+            out_zip.write(cache_path, flat_file_name(resource_path))
+        for batch_dir in batch_dirs:
+            for entry in os.scandir(batch_dir):
+                out_zip.write(entry.path, entry.name)
+    print_log(f"资源编译缓存 命中:{len(hits)} 编译:{len(misses)}")
+    for status, msg in results:
+        if status != 0:
+            return status, msg
+    return 0, "success"
+
+
+def convert_resources(apk_path: str, out_apk_path: str, aapt2):
+    """
+    把apk里面二进制的resources.arsc和AndroidManifest.xml 直接转换成proto格式， 不需要apktool反编译再编译
+    :param apk_path: 只包含资源文件的apk
+    :param out_apk_path: 输出的apk（proto格式）
+    :param aapt2: aapt2的路径，或者是 Aapt2DaemonPool
+    :return:
+    """
+    args = ["convert", "--output-format", "proto",
+            "-o", out_apk_path,
+            apk_path]
+    return execute_aapt2(aapt2, args)
+
+
+def extract_resources_apk(apk_path: str, out_apk_path: str):
+    """
+    从apk里面拷贝出资源相关的文件（AndroidManifest.xml, resources.arsc, res），
+    aapt2 convert 会重写整个apk，只给它资源可以避免大apk的dex, assets, lib 被重写一遍
+    :param apk_path: 原始的apk
+    :param out_apk_path: 输出的apk
+    :return:
+    """
+    with zipfile.ZipFile(apk_path, "r") as source_zip, zipfile.ZipFile(out_apk_path, "w") as out_zip:
+        for info in source_zip.infolist():
+            name = info.filename
+            if name in ("AndroidManifest.xml", "resources.arsc") or (name.startswith("res/") and not info.is_dir()):
+                zip_copy_entry(source_zip, info, out_zip)
+    return 0, "success"
 
 
 def link_resources(link_out_apk_path: str,
@@ -116,8 +754,8 @@ def link_resources(link_out_apk_path: str,
                    target_sdk_version: str,
                    version_code: str,
                    version_name: str,
-                   aapt2: str,
-                   compiled_resources_path: str = None,
+                   aapt2,
+                   compiled_resources_path=None,
                    public_id_path: str = None):
     """
     生成一个apk
@@ -128,25 +766,28 @@ def link_resources(link_out_apk_path: str,
     :param target_sdk_version: 目标版本号
     :param version_code: apk的版本号
     :param version_name: apk的版本名
-    :param aapt2: aapt2的路径
-    :param compiled_resources_path: 编译后res.zip的路径
+    :param aapt2: aapt2的路径，或者是 Aapt2DaemonPool
+    :param compiled_resources_path: 编译后res.zip的路径, 分片编译的时候是多个zip的列表
     :return:
     """
-    cmd = f"{aapt2} link --proto-format \
-        -o {link_out_apk_path} \
-        -I {android} \
-        --min-sdk-version {min_sdk_version} \
-        --target-sdk-version {target_sdk_version}\
-        --version-code {version_code}\
-        --version-name {version_name}\
-        --manifest {input_manifest} \
-        --auto-add-overlay"
-
-    if compiled_resources_path and os.path.exists(compiled_resources_path):
-        cmd += f" -R {compiled_resources_path}"
+    args = ["link", "--proto-format",
+            "-o", link_out_apk_path,
+            "-I", android,
+            "--min-sdk-version", min_sdk_version,
+            "--target-sdk-version", target_sdk_version,
+            "--version-code", version_code,
+            "--version-name", version_name,
+            "--manifest", input_manifest,
+            "--auto-add-overlay"]
+
+    if isinstance(compiled_resources_path, str):
+        compiled_resources_path = [compiled_resources_path]
+    for path in compiled_resources_path or []:
+        if os.path.exists(path):
+            args += ["-R", path]
     if public_id_path and os.path.exists(public_id_path):
-        cmd += f" --stable-ids {public_id_path}"
-    return execute_cmd(cmd)
+        args += ["--stable-ids", public_id_path]
+    return execute_aapt2(aapt2, args)
 
 
 def delete_sign(meta_inf_path):
@@ -163,28 +804,34 @@ def delete_sign(meta_inf_path):
     return 0, "success"
 
 
-def copy_dex(base_dir_path, target_dex_path):
+def copy_dex(base_dir_path, target_dex_path, plan: CopyPlan = None, index: FileIndex = None):
     """
     拷贝dex
     :param base_dir_path: 资源的目录
     :param target_dex_path: 目标目录
+    :param plan: 不为None的时候只添加到拷贝计划里面，不拷贝
+    :param index: base_dir_path的文件索引， 不为None的时候不再读取目录
     """
-    dex_array = list(filter(lambda x: x.endswith("dex") and x.startswith("classes"), os.listdir(base_dir_path)))
+    dex_array = list(filter(lambda x: x.endswith("dex") and x.startswith("classes"),
+                            index.children() if index else os.listdir(base_dir_path)))
     dex_path_array = list(
         map(lambda x: os.path.join(base_dir_path, x), dex_array))
     for dex in dex_path_array:
         basename = os.path.basename(dex)
-        status, msg = copy(dex, os.path.join(target_dex_path, basename))
+        status, msg = (plan.add(dex, os.path.join(target_dex_path, basename), index) if plan
+                       else copy(dex, os.path.join(target_dex_path, basename)))
         if status != 0:
             return status, msg
     return 0, "success"
 
 
-def copy_other(base_dir_path, target_unknown_path):
+def copy_other(base_dir_path, target_unknown_path, plan: CopyPlan = None, index: FileIndex = None):
     """
     拷贝other 文件 (主要是assets)
     :param base_dir_path: 资源的目录
     :param target_unknown_path: 目标目录
+    :param plan: 不为None的时候只添加到拷贝计划里面，不拷贝
+    :param index: base_dir_path的文件索引， 不为None的时候不再读取目录
     """
     # 已知存在的文件，不需要拷贝的， 其他的文件需要拷贝到root目录下面。
     known_file_name_list = ["assets", "build", "dist", "kotlin", "lib", "original", "res", "unknown",
@@ -192,92 +839,274 @@ def copy_other(base_dir_path, target_unknown_path):
     other_file_name_array = list(
         filter(
             lambda x: (not x.startswith("classes")) and (not x.startswith("smali")) and x not in known_file_name_list,
-            os.listdir(base_dir_path)))
+            index.children() if index else os.listdir(base_dir_path)))
     other_file_path_array = list(
         map(lambda x: os.path.join(base_dir_path, x), other_file_name_array))
     for other_file in other_file_path_array:
         basename = os.path.basename(other_file)
-        status, msg = copy(other_file, os.path.join(target_unknown_path, basename))
+        status, msg = (plan.add(other_file, os.path.join(target_unknown_path, basename), index) if plan
+                       else copy(other_file, os.path.join(target_unknown_path, basename)))
         if status != 0:
             return status, msg
     return 0, "success"
 
 
-def build_bundle(bundletool: str, modules: str, out_aab_path: str, bundle_config_json_path: str = None):
+# apk原有的签名文件，写入module的时候需要去掉
+SIGNATURE_FILE_SUFFIX = (".MF", ".SF", ".RSA", ".DSA", ".EC")
+
+
+def module_entry_path(name: str):
+    """
+    apk里面的文件在module压缩包中的路径
+    :param name: apk里面的文件路径
+    :return: module中的路径， 不需要写入的文件返回None
+    """
+    if name.endswith("/"):
+        return None
+    # AndroidManifest.xml 和 res 使用aapt2关联之后的产物
+    if name in ("AndroidManifest.xml", "resources.arsc") or name.startswith("res/"):
+        return None
+    if name.startswith("META-INF/"):
+        if "/" not in name[len("META-INF/"):] and name.upper().endswith(SIGNATURE_FILE_SUFFIX):
+            return None
+        return "root/" + name
+    if "/" not in name and name.startswith("classes") and name.endswith(".dex"):
+        return "dex/" + name
+    if name.startswith("assets/") or name.startswith("lib/"):
+        return name
+    return "root/" + name
+
+
+def write_module_zip(out_module_zip_path: str, link_apk_path: str, source_apk_path: str, exclude_entries=()):
+    """
+    直接从aapt2关联后的apk和原始apk写出module压缩包，不生成中间目录
+    :param out_module_zip_path: 输出的zip文件的路径
+    :param link_apk_path: aapt2关联之后的apk（proto格式）
+    :param source_apk_path: 原始的apk
+    :param exclude_entries: 不需要写入的apk文件（例如移动到pad里面的assets）
+    :return:
+    """
+    exclude_entries = set(exclude_entries)
+    with zipfile.ZipFile(out_module_zip_path, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        with zipfile.ZipFile(link_apk_path, "r") as link_zip:
+            for info in link_zip.infolist():
+                if info.is_dir():
+                    continue
+                name = "manifest/AndroidManifest.xml" if info.filename == "AndroidManifest.xml" else info.filename
+                zip_copy_entry(link_zip, info, out_zip, name)
+        with zipfile.ZipFile(source_apk_path, "r") as source_zip:
+            for info in source_zip.infolist():
+                if info.filename in exclude_entries:
+                    continue
+                name = module_entry_path(info.filename)
+                if name:
+                    zip_copy_entry(source_zip, info, out_zip, name)
+    return 0, "success"
+
+
+def build_assets_pb(asset_file_names) -> bytes:
+    """
+    生成asset pack的assets.pb， 每个直接包含文件的目录一条记录（没有targeting）
+    :param asset_file_names: asset pack里面的文件（apk中的路径， 例如 assets/a/b.map）， 可以是apk的文件列表， 不需要读取磁盘
+    :return: assets.pb的内容
+    """
+    # 遍历一次文件， 标记文件所在的目录
+    asset_dirs = set()
+    for name in asset_file_names:
+        asset_dirs.add(name[:name.rindex("/")])
+    assets = Assets()
+    for path in sorted(asset_dirs):
+        directory = assets.directory.add()
+        directory.path = path
+        directory.targeting.SetInParent()
+    return assets.SerializeToString()
+
+
+def write_asset_pack_zip(out_module_zip_path: str, manifest: bytes, assets_pb: bytes, input_assets_dir: str,
+                         source_apk_path: str = None, source_entries=None, index: FileIndex = None):
+    """
+    写出asset pack的压缩包
+    :param out_module_zip_path: 输出的zip文件的路径
+    :param manifest: proto格式的AndroidManifest.xml
+    :param assets_pb: assets.pb的内容
+    :param input_assets_dir: asset pack的assets目录
+    :param source_apk_path: 原始的apk， 不为空的时候assets直接从apk里面拷贝
+    :param source_entries: 需要从原始apk拷贝的文件
+    :param index: asset pack目录（input_assets_dir的上一级）的文件索引， 为None的时候扫描input_assets_dir
+    :return:
+    """
+    with zipfile.ZipFile(out_module_zip_path, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        out_zip.writestr("manifest/AndroidManifest.xml", manifest)
+        out_zip.writestr("assets.pb", assets_pb)
+        if source_apk_path:
+            with zipfile.ZipFile(source_apk_path, "r") as source_zip:
+                for name in source_entries or []:
+                    zip_copy_entry(source_zip, source_zip.getinfo(name), out_zip)
+        elif index is not None:
+            for path in index.files("assets"):
+                out_zip.write(index.join(path), path)
+        else:
+            for root, dirs, files in os.walk(input_assets_dir):
+                for f in files:
+                    path = os.path.join(root, f)
+                    out_zip.write(path, "assets/" + os.path.relpath(path, input_assets_dir).replace("\\", "/"))
+    return 0, "success"
+
+
+def build_bundle(bundletool: str, modules: str, out_aab_path: str, bundle_config_json_path: str = None,
+                 java: JavaLauncher = None):
     """
     构建aab
     :param bundletool: 构架工具
     :param modules: 需要构建的module， 多个module用 , 隔开
     :param out_aab_path: 输出的aab的路径
     :param bundle_config_json_path: 构建config的配置文件
+    :param java: JavaLauncher
     """
-    cmd = f"java -jar {bundletool} build-bundle \
-        --modules={modules} \
-        --output={out_aab_path} "
+    args = ["build-bundle",
+            f"--modules={modules}",
+            f"--output={out_aab_path}"]
     if bundle_config_json_path and os.path.exists(bundle_config_json_path):
-        cmd += f" --config={bundle_config_json_path}"
-    return execute_cmd(cmd)
+        args.append(f"--config={bundle_config_json_path}")
+    return execute_java(java, bundletool, args)
 
 
-def decode_apk(apk_path: str, decode_apk_dir: str, apktool: str = None):
-    cmd = f"java -jar {apktool} d {apk_path} -s -o {decode_apk_dir}"
-    return execute_cmd(cmd)
+def decode_apk(apk_path: str, decode_apk_dir: str, apktool: str = None, java: JavaLauncher = None):
+    return execute_java(java, apktool, ["d", apk_path, "-s", "-o", decode_apk_dir])
 
 
-def pad_mv_assets(base_dir, pad_dir, pad_reg):
+def pad_mv_assets(base_dir, pack_dirs: dict, rules: AssetRules, moved_file_names: dict, index: FileIndex = None):
     """
-    从base apk里面拷贝资源到pad里面去
+    按规则把base apk的assets移动到asset pack里面去， 所有规则一次遍历完成
     :param base_dir: apk的解压路径
-    :param pad_dir: pad的路径
-    :param pad_reg: pad挑选资源所需要的正则表达式
+    :param pack_dirs: {asset pack的名字: asset pack的目录}
+    :param rules: asset pack的分配规则
+    :param moved_file_names: {asset pack的名字: [移动了的文件（apk中的路径， 例如 assets/a.map）]}
+    :param index: base_dir的文件索引， 不为None的时候从索引查询文件， 移动之后同步更新索引
     :return: 结果
     """
     base_dir = os.path.join(base_dir, "assets")
-    pad_dir = os.path.join(pad_dir, "assets")
-    file_name_list = get_file_name_list(base_dir)
-    pattern = re.compile(pad_reg)
-    # 正则匹配到需要移动的文件
-    mv_file_name = []
-    for file_name in file_name_list:
-        temp_file_name = file_name[1:] if file_name[0] == "/" or file_name[0] == "\\" else file_name
-        if pattern.match(temp_file_name):
-            # 添加到需要移动的list集合里面去
-            mv_file_name.append(temp_file_name)
-    for temp in mv_file_name:
-        mv(os.path.join(base_dir, temp),
-           os.path.join(pad_dir, temp))
+    if index is not None:
+        files = list(map(lambda x: (x[0][len("assets/"):], x[1]), index.file_sizes("assets")))
+    else:
+        files = list(map(lambda x: (x.lstrip("/"), os.path.getsize(os.path.join(base_dir, x.lstrip("/")))),
+                         get_file_name_list(base_dir)))
+    for name, file_names in rules.route(files).items():
+        for temp in file_names:
+            mv(os.path.join(base_dir, temp),
+               os.path.join(pack_dirs[name], "assets", temp))
+            if index is not None:
+                index.discard("assets/" + temp)
+        moved_file_names[name].extend(map(lambda x: "assets/" + x, file_names))
     return 0, "success"
 
 
-def create_pad_module_dir(temp_dir, module_name, package):
+def pad_select_assets(apk_path, rules: AssetRules, selected_file_names: dict):
     """
-    创建一个module目录
-    :param temp_dir: 存放module目录的位置
-    :param module_name: module模块名
-    :param package: apk的包名
-    :return: 返回信息
+    不解压apk， 直接从apk的文件列表里面按规则挑选asset pack的资源
+    :param apk_path: apk的路径
+    :param rules: asset pack的分配规则
+    :param selected_file_names: {asset pack的名字: [挑选出来的文件（apk中的路径， 例如 assets/a.map）]}
+    :return: 结果
     """
-    status, message = copy(BUNDLE_MODULE_TEMPLATE_PATH, temp_dir)
-    if status != 0:
-        return status, message
-    template_android_manifest_path = os.path.join(temp_dir, "AndroidManifest.xml")
-    text = read_file_text(template_android_manifest_path) \
-        .replace("$padName", module_name) \
-        .replace("$applicationId", package)
-    write_file_text(template_android_manifest_path, text)
+    with zipfile.ZipFile(apk_path, "r") as apk_zip:
+        files = [(info.filename[len("assets/"):], info.file_size) for info in apk_zip.infolist()
+                 if info.filename.startswith("assets/") and not info.filename.endswith("/")]
+    for name, file_names in rules.route(files).items():
+        selected_file_names[name].extend(map(lambda x: "assets/" + x, file_names))
     return 0, "success"
 
 
-def sign(temp_aab_path, keystore, storepass, keypass, alias):
-    cmd = f"jarsigner -digestalg SHA1 -sigalg SHA1withRSA \
-        -keystore {keystore} \
-        -storepass {storepass} \
-        -keypass {keypass} \
-        {temp_aab_path} \
-        {alias}"
+def pad_partition_assets(apk_path, rules: AssetRules, max_pack_size: int, group_by: str, plan_path: str):
+    """
+    没有被规则分配的assets按大小自动分配到多个asset pack（添加到rules里面），
+    所有asset pack的规则写到plan_path， 可以通过 --pad_rules 复用
+    :param apk_path: apk的路径
+    :param rules: asset pack的分配规则
+    :param max_pack_size: asset pack的大小上限（字节， 未压缩）
+    :param group_by: 分组方式 dir 或者 ext， 同一个分组的文件放在同一个asset pack
+    :param plan_path: 规则文件的输出路径
+    :return: 结果
+    """
+    with zipfile.ZipFile(apk_path, "r") as apk_zip:
+        files = [(info.filename[len("assets/"):], info.file_size) for info in apk_zip.infolist()
+                 if info.filename.startswith("assets/") and not info.filename.endswith("/")]
+    files = [(path, size) for path, size in files if rules.match(path, size) is None]
+    packs = partition_assets(files, max_pack_size, group_by, exclude_names=rules.names())
+    for pack in packs:
+        rules.add_pack(pack)
+    plan = rules.as_dict()
+    sizes = {pack["name"]: pack["size"] for pack in packs}
+    for pack in plan["packs"]:
+        if pack["name"] in sizes:
+            pack["size"] = sizes[pack["name"]]
+    os.makedirs(os.path.dirname(os.path.abspath(plan_path)), exist_ok=True)
+    write_file_text(plan_path, json.dumps(plan, ensure_ascii=False, indent=2))
+    for pack in packs:
+        print_log(f"[{pack['name']}]:{pack['size'] // 1024 // 1024}MB 规则:{len(pack['rules'])}"
+                  f"{' 单个文件超过大小上限' if pack['size'] > max_pack_size else ''}")
+    return 0, f"分配到{len(packs)}个asset pack， 规则文件: {plan_path}"
+
+
+def python_sign(sign_fun, *args):
+    """
+    使用python签名
+    :param sign_fun: signer里面的签名函数
+    :return: 签名的结果， 没有安装cryptography或者签名失败的时候返回None， 之后使用jarsigner
+    """
+    if not signer.is_available():
+        print_log("[签名]:没有安装cryptography，使用jarsigner")
+        return None
+    try:
+        return sign_fun(*args)
+    except Exception as e:
+        print_log(f"[签名]:python签名失败，使用jarsigner {str(e)}")
+        return None
+
+
+def sign(temp_aab_path, keystore, storepass, keypass, alias, signer_name="jarsigner", digest="SHA1"):
+    """
+    v1签名
+    :param signer_name: python 直接在python里面签名（需要cryptography，只支持SHA-256）， 失败的时候使用jarsigner; jarsigner
+    :param digest: SHA1 或者 SHA-256
+    """
+    if signer_name == "python":
+        result = python_sign(signer.sign_jar, temp_aab_path, keystore, storepass, keypass, alias, digest)
+        if result is not None:
+            return result
+    cmd = ["jarsigner", "-digestalg", digest, "-sigalg", "SHA256withRSA" if digest == "SHA-256" else "SHA1withRSA",
+           "-keystore", keystore,
+           "-storepass", storepass,
+           "-keypass", keypass,
+           temp_aab_path,
+           alias]
     return execute_cmd(cmd)
 
 
+def assemble_aab(base_aab_path, asset_pack_zips: dict, out_aab_path, keystore, storepass, keypass, alias,
+                 signer_name="jarsigner", digest="SHA1"):
+    """
+    生成最终的aab: bundletool输出的aab和asset pack原样（不重新压缩）合并，同时签名， 只写一次输出文件。
+    使用jarsigner的时候先合并到输出文件再签名
+    :param base_aab_path: bundletool输出的aab
+    :param asset_pack_zips: {asset pack的名字: asset pack的压缩包}
+    :param out_aab_path: 输出的aab
+    :param signer_name: python 或者 jarsigner
+    :param digest: SHA1 或者 SHA-256
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(out_aab_path)), exist_ok=True)
+    # 没有分配到资源的asset pack不会生成压缩包
+    sources = [(base_aab_path, "")] + [(zip_path, name) for name, zip_path in asset_pack_zips.items()
+                                       if os.path.isfile(zip_path)]
+    if signer_name == "python":
+        result = python_sign(signer.write_signed_zip, out_aab_path, sources, keystore, storepass, keypass, alias,
+                             digest)
+        if result is not None:
+            return result
+    signer.write_signed_zip(out_aab_path, sources)
+    return sign(out_aab_path, keystore, storepass, keypass, alias, "jarsigner", digest)
+
+
 def create_bundle_config_json(bundle_config_json_path: str, do_not_compress: list):
     glob_not_compress = ['**.3[gG]2', '**.3[gG][pP]', '**.3[gG][pP][pP]', '**.3[gG][pP][pP]2', '**.[aA][aA][cC]',
                          '**.[aA][mM][rR]', '**.[aA][wW][bB]', '**.[gG][iI][fF]', '**.[iI][mM][yY]', '**.[jJ][eE][tT]',
@@ -336,11 +1165,31 @@ class Bundletool:
                  aapt2=AAPT2_PATH,
                  android=ANDROID_JAR_PATH,
                  bundletool=BUNDLETOOL_TOOL_PATH,
-                 print_fun=None):
+                 print_fun=None,
+                 direct_zip=False,
+                 resources_engine="apktool",
+                 aapt2_daemon=False,
+                 compile_workers=1,
+                 cache_dir=None,
+                 compile_cache_size=COMPILE_CACHE_SIZE,
+                 decode_cache_size=DECODE_CACHE_SIZE,
+                 aab_cache_size=AAB_CACHE_SIZE,
+                 cmd_timeout=None,
+                 jvm_profile="default",
+                 appcds=False,
+                 jvm_worker=False,
+                 skip_checks=False,
+                 signer_name="jarsigner",
+                 sign_digest="SHA1",
+                 module_workers=0,
+                 cpu_budget=None,
+                 memory_budget=0):
         global global_print_fun
         global_print_fun = print_fun
         # 初始化环境
         self.pad_reg = ""
+        # asset pack的分配规则（规则文件 + pad_reg）
+        self.asset_rules = AssetRules()
         self.keystore = os.path.abspath(keystore)
         self.storepass = storepass
         self.alias = alias
@@ -349,6 +1198,45 @@ class Bundletool:
         self.aapt2 = os.path.abspath(aapt2)
         self.android = os.path.abspath(android)
         self.bundletool = os.path.abspath(bundletool)
+        # 直接从apk写module压缩包，不生成中间目录
+        self.direct_zip = direct_zip
+        # 资源的处理方式: apktool 反编译再用aapt2编译关联; aapt2 直接用aapt2 convert 转换， 失败了再使用apktool
+        self.resources_engine = resources_engine
+        # aapt2 daemon， 整个Bundletool的生命周期内复用aapt2进程， 调用close()的时候关闭
+        self.aapt2_daemon = Aapt2DaemonPool(self.aapt2) if aapt2_daemon else None
+        # 并行编译res的aapt2数量
+        self.compile_workers = max(1, compile_workers)
+        # 缓存目录，不设置的话不使用缓存
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir else None
+        # 编译res的缓存
+        self.compile_cache = FileCache(os.path.join(self.cache_dir, "compile"),
+                                       compile_cache_size) if self.cache_dir else None
+        # apktool反编译结果的缓存
+        self.decode_cache = FileCache(os.path.join(self.cache_dir, "decode"),
+                                      decode_cache_size) if self.cache_dir else None
+        # 构建结果(aab)的缓存
+        self.aab_cache = FileCache(os.path.join(self.cache_dir, "aab"), aab_cache_size) if self.cache_dir else None
+        self._aapt2_version = None
+        # 单个外部命令的超时时间（秒）， None不限制
+        self.cmd_timeout = cmd_timeout
+        # java -jar 的启动参数和AppCDS归档， 归档保存在缓存目录
+        cds_cache = None
+        if appcds and self.cache_dir:
+            cds_cache = FileCache(os.path.join(self.cache_dir, "cds"), CDS_CACHE_SIZE)
+        # jvm_worker: apktool和bundletool的命令交给常驻的jvm进程执行， 调用close()的时候关闭
+        self.java = JavaLauncher(jvm_profile, cds_cache, jvm_worker)
+        # 不执行java, keytool, aapt2等校验工具和签名， 用于启动的时候已经校验过的服务
+        self.skip_checks = skip_checks
+        # 上一次校验工具的结果
+        self._toolchain_probe = None
+        # 签名方式: python 或者 jarsigner, 以及摘要算法， python签名只支持SHA-256
+        self.signer_name = signer_name
+        self.sign_digest = "SHA-256" if signer_name == "python" else sign_digest
+        # 同时构建module和asset pack的数量， 0 不限制（只受cpu和内存预算限制）
+        self.module_workers = max(0, module_workers)
+        # 流水线同时执行的步骤的cpu和内存（字节）预算， 内存为0的时候不限制
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.memory_budget = memory_budget
 
         # apk的版本信息
         self.min_sdk_version = 19
@@ -356,62 +1244,229 @@ class Bundletool:
         self.version_code = 1
         self.version_name = "1.0.0"
         self.apk_package_name = ""
+        # 直接读取apk得到的信息
+        self.apk_info = None
 
         self.do_not_compress = []
 
         # 构建的module集合
         self.bundle_modules = {}
         self.bundle_asset_pack_modules = {}
+        # 从base移动到asset pack里面的apk文件 {asset pack的名字: [apk里面的路径]}
+        self.asset_pack_entries = {}
+
+    @property
+    def aapt2_runner(self):
+        """
+        compile/link 使用的aapt2， 开启了daemon的时候使用daemon
+        """
+        return self.aapt2_daemon or self.aapt2
+
+    @property
+    def aapt2_version(self):
+        if self._aapt2_version is None:
+            self._aapt2_version = get_aapt2_version(self.aapt2)
+        return self._aapt2_version
+
+    def close(self):
+        """
+        释放Bundletool持有的进程
+        """
+        if self.aapt2_daemon:
+            self.aapt2_daemon.close()
+        self.java.close()
 
     def check_system(self, apk_path, out_aab_path):
         print_log(f"[当前系统]:{get_system()}")
-        print_log(f"[当前系统JAVA版本]↓↓↓↓↓:")
-        _, msg = execute_cmd("java -version")
         print_log(f"[输入apk]:{apk_path}")
         if not os.path.exists(apk_path):
             return -1, f"输入的apk不存在:{apk_path}"
+        # 启动java之前先检查apk是否可以解析
+        try:
+            self.apk_info = inspect_apk(apk_path)
+            print_log(f"[apk信息]:{self.apk_info['package']} versionCode:{self.apk_info['versionCode']} "
+                      f"versionName:{self.apk_info['versionName']} minSdkVersion:{self.apk_info['minSdkVersion']} "
+                      f"targetSdkVersion:{self.apk_info['targetSdkVersion']}")
+        except zipfile.BadZipFile as e:
+            return -4, f"输入的apk不是zip文件:{apk_path} {str(e)}"
+        except KeyError:
+            return -5, f"输入的apk没有AndroidManifest.xml:{apk_path}"
+        except Exception as e:
+            # 解析不了的话后面使用apktool的结果
+            print_log(f"[apk信息]:读取AndroidManifest.xml失败 {str(e)}")
         print_log(f"[输出aab]:{out_aab_path}")
         print_log(f"[签名]:{self.keystore},storepass:{self.storepass},alias:{self.alias},keypass:{self.keypass}")
         if not os.path.exists(self.keystore):
             return -2, f"输入的keystore不存在:{self.keystore}"
+        print_log(f"[apktool]:{self.apktool}")
+        print_log(f"[aapt2]:{self.aapt2}")
+        # 如果是linux 或者 mac 需要给aapt可执行权限
+        if get_system() in [MACOS, Linux]:
+            try:
+                os.chmod(self.aapt2, os.stat(self.aapt2).st_mode | 0o111)
+            except Exception as e:
+                print_log(f"授权失败:{str(e)}")
+        print_log(f"[android]:{self.android}")
+        if not os.path.exists(self.android):
+            return -3, f"输入的android.jar不存在:f{self.android}"
+        print_log(f"[bundletool]:{self.bundletool}")
+        if self.skip_checks:
+            print_log("[工具校验]:跳过")
+            return 0, "success"
+
+        # 工具和签名没有变化的话，使用上一次校验的结果
+        fingerprint = self.toolchain_fingerprint()
+        probe = self._toolchain_probe
+        probe_path = os.path.join(self.cache_dir, "toolchain_probe.json") if self.cache_dir else None
+        if (not probe or probe["fingerprint"] != fingerprint) and probe_path and os.path.exists(probe_path):
+            try:
+                probe = json.loads(read_file_text(probe_path))
+            except ValueError:
+                probe = None
+        if probe and probe["fingerprint"] == fingerprint:
+            self._toolchain_probe = probe
+            self.java.seed_java_version(probe["java"])
+            self._aapt2_version = probe["aapt2"]
+            print_log("[工具校验]:工具和签名没有变化，使用缓存的校验结果")
+            print_log(f"[当前系统JAVA版本]:{probe['java']}")
+            print_log(f"[apktool版本号]:{probe['apktool']}")
+            print_log(f"[aapt2版本号]:{probe['aapt2']}")
+            print_log(f"[bundletool版本号]:{probe['bundletool']}")
+            return 0, "success"
+
+        status, msg, versions = self.probe_toolchain()
+        if status == 0:
+            self._toolchain_probe = dict(versions, fingerprint=fingerprint)
+            self._aapt2_version = versions["aapt2"]
+            if probe_path:
+                temp_path = f"{probe_path}.{os.getpid()}.tmp"
+                write_file_text(temp_path, json.dumps(self._toolchain_probe, ensure_ascii=False, indent=2))
+                os.replace(temp_path, probe_path)
+        return status, msg
+
+    def toolchain_fingerprint(self) -> str:
+        """
+        check_system 校验的工具和签名的指纹: 路径， 大小， 修改时间
+        """
+
+        def stat(path):
+            if not path or not os.path.exists(path):
+                return [path]
+            path = os.path.realpath(path)
+            file_stat = os.stat(path)
+            return [path, file_stat.st_size, file_stat.st_mtime_ns]
+
+        inputs = {
+            "java": stat(shutil.which("java")),
+            "keytool": stat(shutil.which("keytool")),
+            "openssl": stat(shutil.which("openssl")),
+            "apktool": stat(self.apktool),
+            "aapt2": stat(self.aapt2),
+            "bundletool": stat(self.bundletool),
+            "keystore": stat(self.keystore),
+            "key": hashlib.sha256(f"{self.alias}\0{self.storepass}".encode("UTF-8")).hexdigest(),
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("UTF-8")).hexdigest()
+
+    def probe_toolchain(self):
+        """
+        执行java, keytool, apktool, aapt2, bundletool， 校验签名和工具是否可以使用
+        :return: status, msg, 各个工具的版本信息
+        """
+        versions = {}
+        print_log(f"[当前系统JAVA版本]↓↓↓↓↓:")
+        versions["java"] = self.java.java_version[1]
+        print_log(versions["java"])
         status, msg = execute_cmd(
-            f"keytool -list -v -keystore {self.keystore} -storepass {self.storepass} -alias {self.alias} ")
+            ["keytool", "-list", "-v", "-keystore", self.keystore, "-storepass", self.storepass, "-alias", self.alias])
+        print_log(msg)
         status += status
         print_log(f"↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓")
         if get_system() in [MACOS, Linux]:
             status, msg = execute_cmd(
                 f"keytool -exportcert -alias {self.alias} -keystore {self.keystore} -storepass {self.storepass} | openssl sha1 -binary | openssl base64")
+            print_log(msg)
             if status != 0:
-                return -999, "签名错误"
+                return -999, "签名错误", versions
         else:
             print_log("window不去校验，避免没有openssl的库")
         print_log(f"↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑")
-        print_log(f"[apktool]:{self.apktool}")
         print_log(f"[apktool版本号]:↓↓↓↓↓")
-        status, msg = execute_cmd(f"java -jar {self.apktool} --version")
+        status, versions["apktool"] = execute_java(self.java, self.apktool, ["--version"], dump=False)
+        print_log(versions["apktool"])
         status += status
-        # 如果是linux 或者 mac 需要给aapt可执行权限
-        if get_system() in [MACOS, Linux]:
-            try:
-                execute_cmd(f"chmod +x {self.aapt2}")
-            except Exception as e:
-                print_log("授权失败:", e)
-                pass
-            pass
-        print_log(f"[aapt2]:{self.aapt2}")
         print_log(f"[aapt2版本号]:↓↓↓↓↓")
-        status, msg = execute_cmd(f"{self.aapt2} version")
+        status, versions["aapt2"] = execute_cmd([self.aapt2, "version"])
+        print_log(versions["aapt2"])
         status += status
-        print_log(f"[android]:{self.android}")
-        if not os.path.exists(self.android):
-            return -3, f"输入的android.jar不存在:f{self.android}"
-        print_log(f"[bundletool]:{self.bundletool}")
         print_log(f"[bundletool版本号]:↓↓↓↓↓")
-        status, msg = execute_cmd(f"java -jar {self.bundletool} version")
+        status, versions["bundletool"] = execute_java(self.java, self.bundletool, ["version"], dump=False)
+        print_log(versions["bundletool"])
         status += status
-        return status, "success"
+        return status, "success", versions
 
-    def build_public_id(self, public_path, decode_apk_dir):
+    def build_fingerprint(self, apk_path) -> str:
+        """
+        影响构建结果的所有输入的指纹: apk, 工具, asset pack的规则, 构建方式, 签名
+        :param apk_path: apk的路径
+        :return: sha256
+        """
+
+        def digest(path):
+            return file_sha256(path) if os.path.isfile(path) else path
+
+        inputs = {
+            "version": AAB_CACHE_VERSION,
+            "apk": digest(apk_path),
+            "apktool": digest(self.apktool),
+            "aapt2": digest(self.aapt2),
+            "android": digest(self.android),
+            "bundletool": digest(self.bundletool),
+            "asset_rules": self.asset_rules.as_dict(),
+            "direct_zip": self.direct_zip,
+            "resources_engine": self.resources_engine,
+            "keystore": digest(self.keystore),
+            "alias": self.alias,
+            "signer": [self.signer_name, self.sign_digest],
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("UTF-8")).hexdigest()
+
+    def decode_apk_cached(self, apk_path, decode_apk_dir):
+        """
+        apktool 反编译apk, 设置了缓存目录的时候按 apk的sha256 + apktool的sha256 缓存反编译的结果，
+        命中缓存的时候使用硬链接还原，不需要再启动apktool
+        :param apk_path: apk的路径
+        :param decode_apk_dir: 反编译输出的目录
+        """
+        if not self.decode_cache:
+            return decode_apk(apk_path, decode_apk_dir, self.apktool, self.java)
+        key = hashlib.sha256(f"{file_sha256(apk_path)}\0{file_sha256(self.apktool)}\0-s".encode("UTF-8")).hexdigest()
+        cache_path = self.decode_cache.get(key)
+        if cache_path:
+            try:
+                shutil.copytree(cache_path, decode_apk_dir, copy_function=link_or_copy)
+                return 0, "使用缓存的反编译结果"
+            except (OSError, shutil.Error) as e:
+                # 缓存可能被其他进程清理了， 重新反编译
+                print_log(f"还原反编译缓存失败 {str(e)}")
+                delete(decode_apk_dir)
+        status, msg = decode_apk(apk_path, decode_apk_dir, self.apktool, self.java)
+        if status == 0:
+            self.decode_cache.put(key, decode_apk_dir, link=True)
+            self.decode_cache.evict()
+        return status, msg
+
+    def build_public_id(self, public_path, apk_path=None, decode_apk_dir=None):
+        """
+        生成aapt2 --stable-ids 使用的public.txt， 优先直接读取apk里面的resources.arsc，
+        没有apk的时候使用apktool反编译生成的res/values/public.xml
+        :param public_path: 输出的public.txt
+        :param apk_path: apk的路径
+        :param decode_apk_dir: apktool反编译的目录
+        """
+        if apk_path:
+            count = write_public_ids(apk_path, public_path, self.apk_package_name)
+            return 0, f"资源数量:{count}"
         apk_public_path = os.path.join(decode_apk_dir, "res", "values", "public.xml")
         tree = ET.parse(apk_public_path)
         root = tree.getroot()
@@ -424,7 +1479,29 @@ class Bundletool:
         write_file_text(public_path, "".join(s))
         return 0, "success"
 
-    def analysis_apk(self, decode_apk_dir):
+    def analysis_apk(self, apk_path, decode_apk_dir=None):
+        """
+        获取apk的包名，版本信息和不压缩的文件， 直接读取apk里面的AndroidManifest.xml，
+        解析失败的时候使用apktool反编译生成的apktool.yml
+        :param apk_path: apk的路径
+        :param decode_apk_dir: apktool反编译的目录
+        """
+        try:
+            info = self.apk_info or inspect_apk(apk_path)
+        except Exception as e:
+            if not decode_apk_dir:
+                raise
+            print_log(f"读取AndroidManifest.xml失败，使用apktool.yml {str(e)}")
+            return self.analysis_apktool_yml(decode_apk_dir)
+        self.apk_package_name = info["package"]
+        self.min_sdk_version = info["minSdkVersion"] or self.min_sdk_version
+        self.target_sdk_version = info["targetSdkVersion"] or self.target_sdk_version
+        self.version_code = info["versionCode"] or self.version_code
+        self.version_name = info["versionName"] or self.version_name
+        self.do_not_compress = info["doNotCompress"]
+        return 0, "success"
+
+    def analysis_apktool_yml(self, decode_apk_dir):
         content = read_file_text(os.path.join(decode_apk_dir, "apktool.yml"))
         content = content.replace("!!brut.androlib.meta.MetaInfo", "")
         data = yaml.load(content, Loader=yaml.FullLoader)
@@ -444,74 +1521,103 @@ class Bundletool:
         self.apk_package_name = package
         return 0, "success"
 
+    def convert_apk_resources(self, temp_dir, apk_path, out_apk_path):
+        """
+        aapt2 convert 生成proto格式的AndroidManifest.xml 和resources.pb
+        :param temp_dir: 构建的临时根目录
+        :param apk_path: 原始的apk
+        :param out_apk_path: 输出的apk（proto格式）
+        """
+        resources_apk_path = os.path.join(temp_dir, "resources.apk")
+        task("提取apk资源", extract_resources_apk, apk_path, resources_apk_path)
+        task("转换apk资源", convert_resources, resources_apk_path, out_apk_path, self.aapt2_runner)
+        return 0, "success"
+
+    def build_public_id_from_arsc(self, public_path, apk_path):
+        """
+        直接读取resources.arsc生成public.txt， 失败的时候不生成， 之后使用反编译的public.xml
+        """
+        try:
+            return self.build_public_id(public_path, apk_path)
+        except Exception as e:
+            delete(public_path)
+            return 0, f"读取resources.arsc失败，使用public.xml {str(e)}"
+
+    def build_public_id_from_decode(self, public_path, decode_apk_dir):
+        """
+        读取resources.arsc没有生成public.txt的时候， 使用反编译的public.xml
+        """
+        if os.path.exists(public_path):
+            return 0, "已经从resources.arsc生成"
+        return self.build_public_id(public_path, None, decode_apk_dir)
+
     def is_pad(self):
-        return len(self.pad_reg) > 0
-
-    def build_asset_pack(self, temp_dir: str, module_name: str, input_resources_dir: str, out_module_zip_path: str):
-        # 构建的临时目录
-        module_temp_dir = os.path.join(temp_dir, f"{module_name}_temp")
-        # 创建一下
-        os.makedirs(module_temp_dir)
-        # 生成的临时apk
-        link_base_apk_path = os.path.join(module_temp_dir, f"{module_name}.apk")
-        # 解压临时apk后的文件夹路径
-        unzip_link_apk_path = os.path.join(module_temp_dir, module_name)
-        # 解压后临时文件夹，AndroidManifest的路径
-        temp_android_manifest_path = os.path.join(unzip_link_apk_path, "AndroidManifest.xml")
-        # 构建的AndroidManifest.xml文件, 构建后删除
-        input_manifest = os.path.join(input_resources_dir, "AndroidManifest.xml")
-        # 最终的manifest的路径
-        target_manifest_path = os.path.join(input_resources_dir, "manifest", "AndroidManifest.xml")
-        # 构建
-        task(f"[{module_name}]-asset-关联资源", link_asset_resources, link_base_apk_path, input_manifest, self.android,
-             self.aapt2)
-        # 解压
-        task(f"[{module_name}]-asset-解压resources_apk", unzip_file, link_base_apk_path, unzip_link_apk_path)
-        # 拷贝
-        task(f"[{module_name}]-asset-移动AndroidManifest", mv, temp_android_manifest_path, target_manifest_path)
-        # 删除
-        task(f"[{module_name}]-asset-删除AndroidManifest", delete, input_manifest)
+        return bool(self.asset_rules)
 
-        # 构建asset.pb文件
-        asset_path = input_resources_dir
-        asset_dir_list = []
-        for root, dirs, files in os.walk(asset_path):
-            for i in dirs:
-                is_statistics = False
-                for t in os.listdir(os.path.join(root, i)):
-                    if os.path.isfile(os.path.join(root, i, t)):
-                        is_statistics = True
-                        break
-                # print(i, dirs, files)
-                if not is_statistics:
-                    continue
-                path = os.path.join(root, i).replace("\\", os.sep).replace("/", os.sep)
-                if not asset_path.endswith(os.sep):
-                    asset_path = asset_path + os.sep
-                path = path.replace(asset_path, "")
-                asset_dir_list.append(path)
-
-        asset_dir_list = list(filter(lambda x: x.startswith("assets"), asset_dir_list))
-        asset_dir_list = list(map(lambda x: x.replace("\\", "/"), asset_dir_list))
-        asset_dir_list = list(map(lambda x: {"path": x, "targeting": {}}, asset_dir_list))
-
-        my_asset_obj = {
-            "directory": asset_dir_list
-        }
-        my_asset_json_str = json.dumps(my_asset_obj)
-        asset_config = json_format.Parse(my_asset_json_str, Assets())
-        data = asset_config.SerializeToString()
+    def build_asset_pack(self, module_name: str, input_resources_dir: str, out_module_zip_path: str,
+                         source_apk_path: str = None, delivery: str = "install-time"):
+        if not self.asset_pack_entries.get(module_name):
+            return 0, "没有分配到资源，不构建asset pack"
+        # 直接生成proto格式的AndroidManifest.xml， 不需要aapt2关联
+        manifest = asset_pack_manifest(self.apk_package_name, module_name, delivery)
 
-        open(os.path.join(input_resources_dir, "assets.pb"), "wb").write(data)
+        # 构建asset.pb文件
+        source_entries = self.asset_pack_entries.get(module_name) if source_apk_path else None
+        asset_index = None
+        if source_entries is not None:
+            # assets直接从apk拷贝的时候， 通过文件列表统计有文件的目录
+            data = build_assets_pb(source_entries)
+        else:
+            # 扫描一次pad目录， 统计有文件的目录和写入zip都使用这个索引
+            asset_index = FileIndex(input_resources_dir)
+            asset_index.scan()
+            data = build_assets_pb(asset_index.files("assets"))
+
+        # 写入asset pack压缩包， 有原始apk的时候直接拷贝apk里面压缩好的数据
+        task(f"[{module_name}]-asset-写入zip", write_asset_pack_zip, out_module_zip_path, manifest, data,
+             os.path.join(input_resources_dir, "assets"), source_apk_path, source_entries, asset_index)
         return 0, "success"
 
+    def compile_module_resources(self, module_name: str, input_res_dir: str, compiled_resources: str) -> list:
+        """
+        编译module的res， 设置了缓存目录的时候只编译没有缓存的文件，
+        compile_workers 大于1的时候按资源目录分片并行编译
+        :param module_name: module的名字
+        :param input_res_dir: res文件夹的路径
+        :param compiled_resources: 编译res之后的 zip文件的路径
+        :return: 编译后的zip文件列表
+        """
+        compiled_resources_list = []
+        if not os.path.exists(input_res_dir):
+            return compiled_resources_list
+        try:
+            # 资源文件的开头是 '$' 的，存在编译失败的问题。但是好像并不影响程序的使用，正常开发也不会存在$开头的文件,
+            # 文件怎么来的？
+            if self.compile_cache:
+                compiled_resources_list.append(compiled_resources)
+                task(f"[{module_name}]-编译资源", compile_resources_cached, input_res_dir, compiled_resources,
+                     self.aapt2_runner, self.compile_cache, self.aapt2_version, self.compile_workers)
+                task(f"[{module_name}]-清理编译缓存", self.compile_cache.evict)
+            elif self.compile_workers > 1:
+                task(f"[{module_name}]-编译资源", compile_resources_parallel, input_res_dir, compiled_resources,
+                     self.aapt2_runner, self.compile_workers, compiled_resources_list)
+            else:
+                compiled_resources_list.append(compiled_resources)
+                task(f"[{module_name}]-编译资源", compile_resources, input_res_dir, compiled_resources,
+                     self.aapt2_runner)
+        except Exception as e:
+            print_log(f"[{module_name}]-编译资源错误 {str(e)}")
+            pass
+        return compiled_resources_list
+
     def build_module_zip(self, temp_dir: str, module_name: str, input_resources_dir: str, out_module_zip_path: str,
-                         public_id_path: str = None):
+                         public_id_path: str = None, index: FileIndex = None):
         """
         :param temp_dir: 构建的临时根目录
         :param module_name: module的名字
         :param input_resources_dir: 资源路径
         :param out_module_zip_path: 输出的zip文件的路径
+        :param index: input_resources_dir的文件索引， 为None的时候扫描目录
         :return:
         """
         # 用于存放临时的module的目录
@@ -535,13 +1641,8 @@ class Bundletool:
         compiled_resources = os.path.join(module_dir_temp, "compiled_resources.zip")
         # 编译产生中间产物 apk的路径
         link_base_apk_path = os.path.join(module_dir_temp, "base.apk")
-        # 解压编译后目录，用来做构建zip的根目录
+        # 用来做构建zip的根目录， base.apk里面的文件直接从压缩包拷贝，不需要解压到这里
         unzip_link_apk_path = os.path.join(module_dir_temp, module_name)
-
-        # 中间生成的AndroidManifest的路径
-        temp_android_manifest_path = os.path.join(unzip_link_apk_path, "AndroidManifest.xml")
-        # 最终的AndroidManifest的路径
-        target_android_manifest_path = os.path.join(unzip_link_apk_path, "manifest", "AndroidManifest.xml")
         # 最终的assets的目录
         target_assets_path = os.path.join(unzip_link_apk_path, "assets")
         # 最终的lib的路径
@@ -557,51 +1658,122 @@ class Bundletool:
 
         # 1. 编译res 生成 compiled_resources.zip
         # 如果存在res目录才执行这一步操作，pad不一定有这个目录
-        if os.path.exists(input_res_dir):
-            try:
-                # 资源文件的开头是 '$' 的，存在编译失败的问题。但是好像并不影响程序的使用，正常开发也不会存在$开头的文件,
-                # 文件怎么来的？
-                task(f"[{module_name}]-编译资源", compile_resources, input_res_dir, compiled_resources, self.aapt2)
-            except Exception as e:
-                print_log(f"[{module_name}]-编译资源错误 {str(e)}")
-                pass
+        compiled_resources_list = self.compile_module_resources(module_name, input_res_dir, compiled_resources)
         # 2. 通过 compiled_resources.zip 和 AndroidManifest.xml 生成中间产物 base.apk
         task(f"[{module_name}]-关联资源", link_resources, link_base_apk_path, input_manifest, self.android,
              self.min_sdk_version,
-             self.target_sdk_version, self.version_code, self.version_name, self.aapt2, compiled_resources,
+             self.target_sdk_version, self.version_code, self.version_name, self.aapt2_runner,
+             compiled_resources_list,
              public_id_path=public_id_path)
-        # 3. 解压base.apk  获取AndroidManifest.xml 和res
-        task(f"[{module_name}]-解压resources_apk", unzip_file, link_base_apk_path, unzip_link_apk_path)
-        # 4. 修改AndroidManifest.xml 的 位置 构建aab需要的目录
-        task(f"[{module_name}]-移动AndroidManifest", mv, temp_android_manifest_path, target_android_manifest_path)
-        # 5. 拷贝assets
-        if os.path.exists(input_assets):
-            task(f"[{module_name}]-拷贝assets", copy, input_assets, target_assets_path)
-        # 6. 拷贝lib
-        if os.path.exists(input_lib):
-            task(f"[{module_name}]-拷贝lib", copy, input_lib, target_lib_path)
-        # 7. 拷贝其他的文件
-        if os.path.exists(input_unknown):
-            task(f"[{module_name}]-拷贝unknown", copy, input_unknown, target_unknown_path)
-        # 8. 拷贝kotlin的文件
-        if os.path.exists(input_kotlin):
-            task(f"[{module_name}]-拷贝kotlin", copy, input_kotlin, target_kotlin_path)
-        # 9. 删除apk的签名信息
+        if index is None and os.path.exists(input_resources_dir):
+            index = FileIndex(input_resources_dir)
+            task(f"[{module_name}]-扫描资源目录", index.scan)
+        # 3-9. assets, lib, unknown, kotlin, META-INF, dex 和其他文件先收集到拷贝计划里面（后添加的覆盖先添加的），
+        # 再多线程按文件拷贝
+        # 拷贝后的文件只用来压缩， 不会修改， 可以使用硬链接
+        plan = CopyPlan(link=True)
+        # 3. 拷贝assets
+        plan.add(input_assets, target_assets_path, index)
+        # 4. 拷贝lib
+        plan.add(input_lib, target_lib_path, index)
+        # 5. 拷贝其他的文件
+        plan.add(input_unknown, target_unknown_path, index)
+        # 6. 拷贝kotlin的文件
+        plan.add(input_kotlin, target_kotlin_path, index)
+        # 7. 删除apk的签名信息
         if os.path.exists(input_meta_inf_path):
             task(f"[{module_name}]-处理原有的apk签名信息", delete_sign, input_meta_inf_path)
-        # 10. 拷贝META-INF的时候需要先删除 apk的签名信息
-        if os.path.exists(input_meta_inf_path):
-            task(f"[{module_name}]-拷贝META-INF", copy, input_meta_inf_path, target_mata_inf_path)
-        # 11. 拷贝 dex
+        # 8. 拷贝META-INF的时候需要先删除 apk的签名信息
+        plan.add(input_meta_inf_path, target_mata_inf_path, index)
+        # 9. 拷贝 dex
         if os.path.exists(input_resources_dir):
-            task(f"[{module_name}]-拷贝dex", copy_dex, input_resources_dir, target_dex_path)
-        task(f"[{module_name}]-拷贝其他文件", copy_other, input_resources_dir, target_unknown_path)
-        # 12. 压缩成base.zip
+            copy_dex(input_resources_dir, target_dex_path, plan, index)
+        copy_other(input_resources_dir, target_unknown_path, plan, index)
+        os.makedirs(unzip_link_apk_path, exist_ok=True)
+        task(f"[{module_name}]-拷贝文件", plan.execute)
+        # 10. 压缩成base.zip
         task(f"[{module_name}]-压缩zip", zip_file, unzip_link_apk_path, out_module_zip_path)
+        # 11. base.apk里面的AndroidManifest.xml 和res 原样拷贝到base.zip, AndroidManifest.xml 移动到aab需要的目录
+        task(f"[{module_name}]-拷贝resources_apk", zip_merge, link_base_apk_path, out_module_zip_path,
+             name_map={"AndroidManifest.xml": "manifest/AndroidManifest.xml"})
         return 0, "success"
 
-    def run(self, apk_path, out_aab_path, pad_reg=""):
+    def build_module_zip_direct(self, temp_dir: str, module_name: str, apk_path: str, input_resources_dir: str,
+                                out_module_zip_path: str, public_id_path: str = None):
+        """
+        直接从原始apk和aapt2关联后的apk写出module压缩包，不需要解压和拷贝到中间目录
+        :param temp_dir: 构建的临时根目录
+        :param module_name: module的名字
+        :param apk_path: 原始的apk
+        :param input_resources_dir: 资源路径（需要res 和 AndroidManifest.xml）
+        :param out_module_zip_path: 输出的zip文件的路径
+        :param public_id_path: public.txt的路径
+        :return:
+        """
+        module_dir_temp = os.path.join(temp_dir, module_name + "_temp")
+        os.makedirs(module_dir_temp)
+        input_res_dir = os.path.join(input_resources_dir, "res")
+        input_manifest = os.path.join(input_resources_dir, "AndroidManifest.xml")
+        compiled_resources = os.path.join(module_dir_temp, "compiled_resources.zip")
+        link_base_apk_path = os.path.join(module_dir_temp, "base.apk")
+
+        # 1. 编译res 生成 compiled_resources.zip
+        compiled_resources_list = self.compile_module_resources(module_name, input_res_dir, compiled_resources)
+        # 2. 通过 compiled_resources.zip 和 AndroidManifest.xml 生成中间产物 base.apk
+        task(f"[{module_name}]-关联资源", link_resources, link_base_apk_path, input_manifest, self.android,
+             self.min_sdk_version,
+             self.target_sdk_version, self.version_code, self.version_name, self.aapt2_runner,
+             compiled_resources_list,
+             public_id_path=public_id_path)
+        # 3. 从base.apk 和 原始apk 直接写出 base.zip
+        exclude_entries = [e for entries in self.asset_pack_entries.values() for e in entries]
+        task(f"[{module_name}]-写入zip", write_module_zip, out_module_zip_path, link_base_apk_path, apk_path,
+             exclude_entries)
+        return 0, "success"
+
+    def run(self, apk_path, out_aab_path, pad_reg="", pad_rules="", pad_size=0, pad_group="dir", pad_plan=""):
+        """
+        :param pad_reg: 正则表达式， 匹配的assets移动到 pad_sy（install-time）
+        :param pad_rules: asset pack的规则文件（json）， 可以分配到多个asset pack， 见 AssetRules
+        :param pad_size: 大于0的时候， 规则没有分配的assets按大小自动分配到多个install-time的asset pack（字节）
+        :param pad_group: 自动分配的分组方式: dir 按目录; ext 按扩展名
+        :param pad_plan: 自动分配的规则文件的输出路径， 默认和输出的aab放在一起
+        """
         self.pad_reg = pad_reg
+        try:
+            self.asset_rules = AssetRules.load(pad_rules, pad_reg)
+            if pad_size > 0:
+                pad_plan = pad_plan or os.path.splitext(out_aab_path)[0] + "_pad_rules.json"
+                task("自动分配asset pack", pad_partition_assets, apk_path, self.asset_rules, pad_size, pad_group,
+                     pad_plan)
+        except Exception as e:
+            print_log(f"asset pack规则错误 {str(e)}")
+            return -1, str(e)
+        # 同一个Bundletool可以多次执行run， 清理上一次的apk信息和模块信息
+        self.apk_info = None
+        self.apk_package_name = ""
+        self.bundle_modules = {}
+        self.bundle_asset_pack_modules = {}
+        self.asset_pack_entries = {}
+        # 根据apk的大小设置java的堆内存
+        self.java.input_size = os.path.getsize(apk_path) if os.path.isfile(apk_path) else 0
+
+        # 相同的输入已经构建过的话， 直接使用缓存的aab
+        fingerprint = None
+        if self.aab_cache and os.path.isfile(apk_path):
+            try:
+                fingerprint = self.build_fingerprint(apk_path)
+                cache_path = self.aab_cache.get(fingerprint)
+                if cache_path:
+                    print_log(f"[使用缓存的aab]:{fingerprint}")
+                    delete(out_aab_path)
+                    os.makedirs(os.path.dirname(os.path.abspath(out_aab_path)), exist_ok=True)
+                    # 输出的aab之后可能会被修改， 不和缓存共用硬链接
+                    fast_copy_file(cache_path, out_aab_path)
+                    return 0, "success"
+            except Exception as e:
+                print_log(e)
+                return -1, str(e)
 
         # 生成临时的工作目录
         temp_dir = f"temp_{'{0:%Y%m%d%H%M%S}'.format(datetime.datetime.now())}"
@@ -615,6 +1787,8 @@ class Bundletool:
         os.mkdir(module_asset_pack_dir)
 
         decode_apk_dir = os.path.join(temp_dir, "decode_apk_dir")
+        # 反编译目录的文件索引， 反编译完成后扫描一次， 后面的步骤共用
+        decode_index = FileIndex(decode_apk_dir)
 
         temp_aab_path = os.path.join(temp_dir, "base.aab")
 
@@ -622,53 +1796,134 @@ class Bundletool:
         self.bundle_modules["base"] = decode_apk_dir
 
         public_id_path = os.path.join(temp_dir, "public.txt")
+        # aapt2 convert 生成的proto格式的apk
+        convert_apk_path = os.path.join(temp_dir, "resources_proto.apk")
 
-        try:
-            task("环境&参数校验", self.check_system, apk_path, out_aab_path)
-            task("解压input_apk", decode_apk, apk_path, decode_apk_dir, self.apktool)
-            task("解析apk信息", self.analysis_apk, decode_apk_dir)
-            task("构建public.txt", self.build_public_id, public_id_path, decode_apk_dir)
-            if self.is_pad():
-                module_name = "pad_sy"
-                pad_module_temp_dir = os.path.join(temp_dir, module_name)
-                package = self.apk_package_name
-                task("构建一个pad模块", create_pad_module_dir, pad_module_temp_dir, module_name, package)
-                task("移动资源到pad模块", pad_mv_assets, decode_apk_dir, pad_module_temp_dir, self.pad_reg)
-                self.bundle_asset_pack_modules[module_name] = pad_module_temp_dir
-
-            for name, path in self.bundle_modules.items():
-                task(f"[{name}]-构建module压缩包", self.build_module_zip, temp_dir, name, path,
-                     os.path.join(module_zip_dir, name + ".zip"), public_id_path)
-
-            for name, path in self.bundle_asset_pack_modules.items():
-                task(f"[{name}]-构建asset_pack_module", self.build_asset_pack, temp_dir, name, path,
-                     os.path.join(module_asset_pack_dir, name + ".zip"))
-            # 获取所有的module 的name
-            all_module_name = self.bundle_modules.keys()
-            # 获取所有module的path
-            all_module_path = list(map(lambda x: os.path.join(module_zip_dir, x + ".zip"), all_module_name))
-            # 构建编译的module
-            modules = ",".join(all_module_path)
-            bundle_config_json_path = os.path.join(temp_dir, "BundleConfig.pb.json")
-            task("构建config json", create_bundle_config_json, bundle_config_json_path, self.do_not_compress)
-            task("构建aab", build_bundle, self.bundletool, modules, temp_aab_path, bundle_config_json_path)
-            for name, path in self.bundle_asset_pack_modules.items():
-                task(f"[{name}]-压缩asset_pack in aab", zip_file, path, temp_aab_path, name)
-            task("签名", sign, temp_aab_path, self.keystore, self.storepass, self.keypass, self.alias)
-            task("拷贝输出拷贝", copy, temp_aab_path, out_aab_path)
-        except Exception as e:
-            print_log(e)
-            return -1, str(e)
-        finally:
-            pass
-            status, _ = delete(temp_dir)
+        with cmd_scope(timeout=self.cmd_timeout):
+            try:
+                task("环境&参数校验", self.check_system, apk_path, out_aab_path)
+                use_convert = self.resources_engine == "aapt2"
+                if use_convert and not self.apk_info:
+                    # 直接读取不了apk信息的时候需要apktool反编译生成的apktool.yml
+                    print_log("读取apk信息失败，使用apktool处理资源")
+                    use_convert = False
+                if use_convert:
+                    try:
+                        task("aapt2转换资源", self.convert_apk_resources, temp_dir, apk_path, convert_apk_path)
+                    except Exception as e:
+                        # 转换失败的话使用apktool反编译再编译
+                        print_log(f"aapt2转换资源失败，使用apktool处理资源 {str(e)}")
+                        use_convert = False
+                # 后面的步骤按依赖关系并行执行
+                pipeline = Pipeline(bind_cmd_scope(run_stage), self.cpu_budget, self.memory_budget)
+                pipeline.set_group_limit("module", self.module_workers)
+                jvm_memory = self.java.heap_size()
+                if use_convert:
+                    pipeline.add("解析apk信息", self.analysis_apk, apk_path, outputs=["apk_info"])
+                else:
+                    pipeline.add("解压input_apk", self.decode_apk_cached, apk_path, decode_apk_dir,
+                                 outputs=["decode_dir"], cpu=2, memory=jvm_memory)
+                    pipeline.add("扫描反编译目录", decode_index.scan, inputs=["decode_dir"], outputs=["decode_index"])
+                    if self.apk_info:
+                        # apk信息和public.txt直接从apk读取，和反编译同时进行
+                        pipeline.add("解析apk信息", self.analysis_apk, apk_path, outputs=["apk_info"])
+                        # public.txt需要apk的包名
+                        pipeline.add("构建public.txt", self.build_public_id_from_arsc, public_id_path, apk_path,
+                                     inputs=["apk_info"], outputs=["public_id_arsc"])
+                        pipeline.add("构建public.txt(public.xml)", self.build_public_id_from_decode, public_id_path,
+                                     decode_apk_dir, inputs=["public_id_arsc", "decode_dir"], outputs=["public_id"])
+                    else:
+                        pipeline.add("解析apk信息", self.analysis_apk, apk_path, decode_apk_dir,
+                                     inputs=["decode_dir"], outputs=["apk_info"])
+                        pipeline.add("构建public.txt", self.build_public_id, public_id_path, None, decode_apk_dir,
+                                     inputs=["decode_dir", "apk_info"], outputs=["public_id"])
+                bundle_config_json_path = os.path.join(temp_dir, "BundleConfig.pb.json")
+                # 参数依赖 解析apk信息 的结果， 执行的时候再读取
+                pipeline.add("构建config json",
+                             lambda: create_bundle_config_json(bundle_config_json_path, self.do_not_compress),
+                             inputs=["apk_info"], outputs=["bundle_config"])
+
+                pad_inputs = []
+                if self.is_pad():
+                    for module_name in self.asset_rules.names():
+                        self.asset_pack_entries[module_name] = []
+                        self.bundle_asset_pack_modules[module_name] = os.path.join(temp_dir, module_name)
+                    # 所有asset pack的规则一次遍历assets完成分配
+                    if use_convert:
+                        pipeline.add("挑选pad资源", pad_select_assets, apk_path, self.asset_rules,
+                                     self.asset_pack_entries, outputs=["pad_assets"])
+                    else:
+                        # 移动资源会修改反编译的目录， base模块需要等移动完成
+                        pipeline.add("移动资源到pad模块", pad_mv_assets, decode_apk_dir, self.bundle_asset_pack_modules,
+                                     self.asset_rules, self.asset_pack_entries, decode_index,
+                                     inputs=["decode_index"], outputs=["pad_assets"])
+                    pad_inputs = ["pad_assets"]
+
+                module_outputs = []
+                for name, path in self.bundle_modules.items():
+                    module_zip_path = os.path.join(module_zip_dir, name + ".zip")
+                    module_outputs.append(f"module:{name}")
+                    if use_convert:
+                        # 需要排除的文件在挑选pad资源之后才有
+                        pipeline.add(f"[{name}]-构建module压缩包",
+                                     lambda out=module_zip_path: write_module_zip(
+                                         out, convert_apk_path, apk_path,
+                                         [e for entries in self.asset_pack_entries.values() for e in entries]),
+                                     inputs=pad_inputs, outputs=module_outputs[-1:], group="module")
+                    elif self.direct_zip:
+                        pipeline.add(f"[{name}]-构建module压缩包", self.build_module_zip_direct, temp_dir, name,
+                                     apk_path, path, module_zip_path, public_id_path,
+                                     inputs=["decode_dir", "public_id", "apk_info"] + pad_inputs,
+                                     outputs=module_outputs[-1:], cpu=self.compile_workers, group="module")
+                    else:
+                        pipeline.add(f"[{name}]-构建module压缩包", self.build_module_zip, temp_dir, name, path,
+                                     module_zip_path, public_id_path, decode_index if path == decode_apk_dir else None,
+                                     inputs=["decode_index", "public_id", "apk_info"] + pad_inputs,
+                                     outputs=module_outputs[-1:], cpu=self.compile_workers, group="module")
+
+                asset_pack_outputs = []
+                asset_pack_zips = {}
+                for name, path in self.bundle_asset_pack_modules.items():
+                    asset_pack_zips[name] = os.path.join(module_asset_pack_dir, name + ".zip")
+                    asset_pack_outputs.append(f"asset_pack:{name}")
+                    pipeline.add(f"[{name}]-构建asset_pack_module", self.build_asset_pack, name, path,
+                                 asset_pack_zips[name], apk_path if self.direct_zip or use_convert else None,
+                                 self.asset_rules.delivery(name), inputs=["apk_info"] + pad_inputs,
+                                 outputs=asset_pack_outputs[-1:], group="module")
+
+                # 获取所有module的path
+                all_module_path = list(map(lambda x: os.path.join(module_zip_dir, x + ".zip"), self.bundle_modules))
+                # 构建编译的module
+                modules = ",".join(all_module_path)
+                pipeline.add("构建aab", build_bundle, self.bundletool, modules, temp_aab_path, bundle_config_json_path,
+                             self.java, inputs=module_outputs + ["bundle_config"], outputs=["base_aab"], cpu=2,
+                             memory=jvm_memory)
+                pipeline.add("合并asset_pack,签名,输出aab", assemble_aab, temp_aab_path, asset_pack_zips, out_aab_path,
+                             self.keystore, self.storepass, self.keypass, self.alias, self.signer_name,
+                             self.sign_digest, inputs=["base_aab"] + asset_pack_outputs, outputs=["out_aab"])
+                try:
+                    pipeline.run()
+                finally:
+                    print_log(f"[流水线]↓↓↓↓↓\n{pipeline.summary()}")
+                if fingerprint:
+                    self.aab_cache.put(fingerprint, out_aab_path)
+                    task("清理aab缓存", self.aab_cache.evict)
+            except Exception as e:
+                print_log(e)
+                return -1, str(e)
+            finally:
+                pass
+                status, _ = delete(temp_dir)
+                print_log(f"[外部命令统计]↓↓↓↓↓\n{cmd_stats_summary()}")
+                print_log(f"[文件移动/拷贝方式]:{copy_stats_summary()}")
         return 0, "success"
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="37手游apk转aab")
     parser.add_argument("-i", "--input", help="输入apk的路径", required=True)
-    parser.add_argument("-o", "--output", help="输出apk的路径", required=True)
+    parser.add_argument("-o", "--output", help="输出apk的路径")
+    parser.add_argument("--inspect", help="只输出apk的包名,版本等信息(json)，不转换", action="store_true")
     parser.add_argument("--keystore", help="签名文件路径", default=KEYSTORE)
     parser.add_argument("--store_password", help="签名文件路径",
                         default=STORE_PASSWORD)
@@ -683,9 +1938,59 @@ if __name__ == "__main__":
         "--bundletool", help="bundletool.jar 路径", default=BUNDLETOOL_TOOL_PATH)
     parser.add_argument(
         "--pad_reg", help="从Assets目录中提取pad资源，通过正则去匹配文件拷贝.", default="")
+    parser.add_argument(
+        "--pad_rules", help="asset pack的规则文件(json)，按正则,通配符,路径前缀,文件大小把assets分配到多个asset pack", default="")
+    parser.add_argument(
+        "--pad_size", help="asset pack的大小上限(MB)，大于0的时候没有被规则分配的assets按大小自动分配到多个asset pack", type=int,
+        default=0)
+    parser.add_argument(
+        "--pad_group", help="自动分配asset pack的分组方式，同一个分组的文件放在同一个asset pack: dir 按目录; ext 按扩展名",
+        choices=list(PARTITION_GROUPS), default="dir")
+    parser.add_argument(
+        "--pad_plan", help="自动分配的结果(规则文件)的输出路径，可以通过--pad_rules复用，默认为 输出aab的路径_pad_rules.json",
+        default="")
+    parser.add_argument(
+        "--direct_zip", help="直接从apk写入module压缩包，不解压拷贝到中间目录", action="store_true")
+    parser.add_argument(
+        "--resources_engine", help="资源的处理方式: apktool 反编译再编译; aapt2 使用aapt2 convert直接转换，失败了再使用apktool",
+        choices=["apktool", "aapt2"], default="apktool")
+    parser.add_argument(
+        "--aapt2_daemon", help="使用aapt2 daemon模式执行compile/link，复用一个aapt2进程", action="store_true")
+    parser.add_argument(
+        "--compile_workers", help="并行编译res的aapt2数量，按资源目录分片编译", type=int, default=1)
+    parser.add_argument("--cache_dir", help="缓存目录，不设置的话不使用缓存", default=None)
+    parser.add_argument("--compile_cache_size", help="res编译缓存的大小上限(MB)", type=int,
+                        default=COMPILE_CACHE_SIZE // 1024 // 1024)
+    parser.add_argument("--decode_cache_size", help="apktool反编译缓存的大小上限(MB)", type=int,
+                        default=DECODE_CACHE_SIZE // 1024 // 1024)
+    parser.add_argument("--aab_cache_size", help="aab构建结果缓存的大小上限(MB)", type=int,
+                        default=AAB_CACHE_SIZE // 1024 // 1024)
+    parser.add_argument("--cmd_timeout", help="单个外部命令(java,aapt2等)的超时时间(秒)，不设置的话不限制", type=float,
+                        default=None)
+    parser.add_argument("--jvm_profile", help="java -jar 的启动参数: default 不添加参数; fast 只使用C1编译; "
+                                              "throughput 并行GC。fast和throughput根据apk大小设置堆内存",
+                        choices=list(JVM_PROFILES.keys()), default="default")
+    parser.add_argument("--appcds", help="为apktool和bundletool生成并复用AppCDS归档(需要java13以上和--cache_dir)",
+                        action="store_true")
+    parser.add_argument("--jvm_worker", help="apktool和bundletool的命令交给常驻的jvm进程执行，不用每次都启动jvm(需要java11以上)",
+                        action="store_true")
+    parser.add_argument("--skip_checks", help="不校验java,apktool,aapt2,bundletool和签名(服务启动的时候已经校验过的情况)",
+                        action="store_true")
+    parser.add_argument("--signer", help="签名方式: python 直接签名（需要安装cryptography，多线程计算摘要）; jarsigner",
+                        choices=["python", "jarsigner"], default="jarsigner")
+    parser.add_argument("--sign_digest", help="签名的摘要算法，默认jarsigner使用SHA1，python只支持SHA-256",
+                        choices=["SHA-256", "SHA1"])
+    parser.add_argument("--module_workers", help="同时构建module和asset pack的数量，0 不限制", type=int, default=0)
+    parser.add_argument("--cpu_budget", help="同时执行的步骤占用的cpu总数，默认为cpu的数量", type=int, default=None)
+    parser.add_argument("--memory_budget", help="同时执行的步骤占用的内存总数(MB)，0 不限制", type=int, default=0)
     args = parser.parse_args()
 
     input_apk_path = os.path.abspath(args.input)
+    if args.inspect:
+        print(json.dumps(inspect_apk(input_apk_path), ensure_ascii=False, indent=2))
+        sys.exit(0)
+    if not args.output:
+        parser.error("the following arguments are required: -o/--output")
     output_aab_path = os.path.abspath(args.output)
     keystore = args.keystore
     store_password = args.store_password
@@ -696,6 +2001,30 @@ if __name__ == "__main__":
     android = args.android
     bundletool = args.bundletool
     input_pad_reg = args.pad_reg
+    input_pad_rules = args.pad_rules
+    input_pad_size = args.pad_size * 1024 * 1024
+    input_pad_group = args.pad_group
+    input_pad_plan = args.pad_plan
+    direct_zip = args.direct_zip
+    resources_engine = args.resources_engine
+    aapt2_daemon = args.aapt2_daemon
+    compile_workers = args.compile_workers
+    cache_dir = args.cache_dir
+    compile_cache_size = args.compile_cache_size * 1024 * 1024
+    decode_cache_size = args.decode_cache_size * 1024 * 1024
+    aab_cache_size = args.aab_cache_size * 1024 * 1024
+    cmd_timeout = args.cmd_timeout
+    jvm_profile = args.jvm_profile
+    appcds = args.appcds
+    jvm_worker = args.jvm_worker
+    skip_checks = args.skip_checks
+    signer_name = args.signer
+    if signer_name == "python" and args.sign_digest == "SHA1":
+        parser.error("--signer python 只支持 --sign_digest SHA-256")
+    sign_digest = args.sign_digest or ("SHA-256" if signer_name == "python" else "SHA1")
+    module_workers = args.module_workers
+    cpu_budget = args.cpu_budget
+    memory_budget = args.memory_budget * 1024 * 1024
 
     bundletool = Bundletool(keystore=keystore,
                             storepass=store_password,
@@ -704,10 +2033,33 @@ if __name__ == "__main__":
                             apktool=input_apktool_path,
                             aapt2=aapt2,
                             android=android,
-                            bundletool=bundletool)
+                            bundletool=bundletool,
+                            direct_zip=direct_zip,
+                            resources_engine=resources_engine,
+                            aapt2_daemon=aapt2_daemon,
+                            compile_workers=compile_workers,
+                            cache_dir=cache_dir,
+                            compile_cache_size=compile_cache_size,
+                            decode_cache_size=decode_cache_size,
+                            aab_cache_size=aab_cache_size,
+                            cmd_timeout=cmd_timeout,
+                            jvm_profile=jvm_profile,
+                            appcds=appcds,
+                            jvm_worker=jvm_worker,
+                            skip_checks=skip_checks,
+                            signer_name=signer_name,
+                            sign_digest=sign_digest,
+                            module_workers=module_workers,
+                            cpu_budget=cpu_budget,
+                            memory_budget=memory_budget)
     status, message = bundletool.run(apk_path=input_apk_path,
                                      out_aab_path=output_aab_path,
-                                     pad_reg=input_pad_reg)
+                                     pad_reg=input_pad_reg,
+                                     pad_rules=input_pad_rules,
+                                     pad_size=input_pad_size,
+                                     pad_group=input_pad_group,
+                                     pad_plan=input_pad_plan)
+    bundletool.close()
 
     sys.exit(status)
 pass
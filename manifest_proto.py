@@ -0,0 +1,96 @@
+# coding=utf-8
+"""
+Copyright (C) 2021 37手游安卓团队
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# 直接生成 aapt2 proto格式（Resources.proto 里面的 XmlNode）的AndroidManifest.xml，
+# asset pack 的manifest很简单， 不需要调用 aapt2 link
+#
+# message XmlNode { XmlElement element = 1; string text = 2; }
+# message XmlElement { repeated XmlNamespace namespace_declaration = 1; string namespace_uri = 2; string name = 3;
+#                      repeated XmlAttribute attribute = 4; repeated XmlNode child = 5; }
+# message XmlNamespace { string prefix = 1; string uri = 2; }
+# message XmlAttribute { string namespace_uri = 1; string name = 2; string value = 3; }
+
+ANDROID_NAMESPACE = "http://schemas.android.com/apk/res/android"
+DIST_NAMESPACE = "http://schemas.android.com/apk/distribution"
+
+# asset pack 支持的分发方式
+DELIVERY_MODES = ("install-time", "fast-follow", "on-demand")
+
+
+def _varint(value: int) -> bytes:
+    data = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(bits | 0x80)
+        else:
+            data.append(bits)
+            return bytes(data)
+
+
+def _field(number: int, data: bytes) -> bytes:
+    """
+    length-delimited 类型的字段（string, message）
+    """
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _string_field(number: int, value: str) -> bytes:
+    # proto3 的默认值不写出
+    return _field(number, value.encode("UTF-8")) if value else b""
+
+
+def xml_attribute(name: str, value: str, namespace_uri: str = "") -> bytes:
+    return _string_field(1, namespace_uri) + _string_field(2, name) + _string_field(3, value)
+
+
+def xml_element(name: str, attributes=(), children=(), namespace_uri: str = "", namespaces=()) -> bytes:
+    """
+    :param attributes: xml_attribute 的结果
+    :param children: 子元素， xml_element 的结果
+    :param namespaces: 声明的命名空间 [(prefix, uri)]
+    :return: XmlNode
+    """
+    element = b"".join(_field(1, _string_field(1, prefix) + _string_field(2, uri)) for prefix, uri in namespaces)
+    element += _string_field(2, namespace_uri) + _string_field(3, name)
+    element += b"".join(_field(4, attribute) for attribute in attributes)
+    element += b"".join(_field(5, child) for child in children)
+    return _field(1, element)
+
+
+def asset_pack_manifest(package: str, module_name: str, delivery: str = "install-time") -> bytes:
+    """
+    asset pack的AndroidManifest.xml（和 tools/pad_template/AndroidManifest.xml 一样的结构）
+    :param package: apk的包名
+    :param module_name: asset pack的名字
+    :param delivery: 分发方式 install-time, fast-follow, on-demand
+    :return: proto格式的manifest
+    """
+    if delivery not in DELIVERY_MODES:
+        raise ValueError(f"不支持的分发方式 {delivery}， 可选: {', '.join(DELIVERY_MODES)}")
+    module = xml_element("module",
+                         [xml_attribute("type", "asset-pack", DIST_NAMESPACE)],
+                         [xml_element("delivery", children=[xml_element(delivery, namespace_uri=DIST_NAMESPACE)],
+                                      namespace_uri=DIST_NAMESPACE),
+                          xml_element("fusing", [xml_attribute("include", "true", DIST_NAMESPACE)],
+                                      namespace_uri=DIST_NAMESPACE)],
+                         namespace_uri=DIST_NAMESPACE)
+    return xml_element("manifest",
+                       [xml_attribute("package", package), xml_attribute("split", module_name)],
+                       [module],
+                       namespaces=[("android", ANDROID_NAMESPACE), ("dist", DIST_NAMESPACE)])
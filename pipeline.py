@@ -0,0 +1,206 @@
+# coding=utf-8
+"""
+Copyright (C) 2021 37手游安卓团队
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage:
+    """
+    流水线里面的一个步骤
+    """
+
+    def __init__(self, name: str, fun, args: tuple = (), inputs=(), outputs=(), cpu: int = 1, memory: int = 0,
+                 group: str = None):
+        """
+        :param name: 步骤的名字， 用于日志
+        :param fun: 执行的方法， 返回 status, msg
+        :param args: 方法的参数
+        :param inputs: 依赖的产物， 产出这些产物的步骤完成之后才会执行
+        :param outputs: 这个步骤的产物
+        :param cpu: 占用的cpu数量
+        :param memory: 占用的内存（字节）
+        :param group: 分组， 可以限制同一个分组同时执行的数量
+        """
+        self.name = name
+        self.fun = fun
+        self.args = args
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cpu = max(1, cpu)
+        self.memory = memory
+        self.group = group
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def duration(self) -> float:
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+
+class Pipeline:
+    """
+    按依赖关系执行步骤: 输入都已经产出的步骤在cpu和内存预算之内并行执行。
+    有一个步骤失败的时候，不再执行新的步骤，等正在执行的步骤结束后抛出第一个异常
+    """
+
+    def __init__(self, runner=None, cpu_budget: int = None, memory_budget: int = 0):
+        """
+        :param runner: 执行步骤的方法 runner(stage, cancel_event)， 失败的时候抛出异常，
+                       默认直接调用 stage.fun(*stage.args)， status不为0的时候抛出异常
+        :param cpu_budget: 同时执行的步骤占用的cpu总数， 默认为cpu的数量
+        :param memory_budget: 同时执行的步骤占用的内存总数（字节）， 0 不限制
+        """
+        self.runner = runner or self.default_runner
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.memory_budget = memory_budget
+        self.group_limits = {}
+        self.stages = []
+        self.cancel_event = threading.Event()
+        self.start_time = None
+        self.end_time = None
+
+    @staticmethod
+    def default_runner(stage: Stage, cancel_event: threading.Event):
+        status, msg = stage.fun(*stage.args)
+        if status != 0:
+            raise Exception(f"{stage.name} 执行异常status:{status} msg:{msg}")
+
+    def add(self, name: str, fun, *args, inputs=(), outputs=(), cpu: int = 1, memory: int = 0,
+            group: str = None) -> Stage:
+        stage = Stage(name, fun, args, inputs, outputs, cpu, memory, group)
+        self.stages.append(stage)
+        return stage
+
+    def set_group_limit(self, group: str, limit: int):
+        """
+        限制一个分组同时执行的步骤数量， 0 不限制
+        """
+        self.group_limits[group] = limit
+
+    def producers(self) -> dict:
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"产物 {output} 有多个步骤产出: {producers[output].name}, {stage.name}")
+                producers[output] = stage
+        for stage in self.stages:
+            for item in stage.inputs:
+                if item not in producers:
+                    raise ValueError(f"步骤 {stage.name} 的输入 {item} 没有步骤产出")
+        return producers
+
+    def dependencies(self, stage: Stage, producers: dict) -> list:
+        deps = []
+        for item in stage.inputs:
+            if producers[item] not in deps:
+                deps.append(producers[item])
+        return deps
+
+    def run(self):
+        producers = self.producers()
+        deps = {stage: self.dependencies(stage, producers) for stage in self.stages}
+        pending = list(self.stages)
+        running = {}
+        done = set()
+        errors = []
+        self.start_time = time.time()
+
+        def fits(stage):
+            if not running:
+                return True
+            running_stages = list(running.values())
+            if sum(s.cpu for s in running_stages) + stage.cpu > self.cpu_budget:
+                return False
+            if self.memory_budget and sum(s.memory for s in running_stages) + stage.memory > self.memory_budget:
+                return False
+            limit = self.group_limits.get(stage.group)
+            if limit and sum(1 for s in running_stages if s.group == stage.group) >= limit:
+                return False
+            return True
+
+        def execute(stage):
+            stage.start_time = time.time()
+            try:
+                self.runner(stage, self.cancel_event)
+            finally:
+                stage.end_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as executor:
+            while running or (pending and not self.cancel_event.is_set()):
+                if not self.cancel_event.is_set():
+                    for stage in list(pending):
+                        if all(dep in done for dep in deps[stage]) and fits(stage):
+                            pending.remove(stage)
+                            running[executor.submit(execute, stage)] = stage
+                if not running:
+                    raise ValueError(f"步骤之间存在循环依赖: {', '.join(s.name for s in pending)}")
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(stage)
+                    except Exception as e:
+                        if not self.cancel_event.is_set():
+                            errors.append(e)
+                        self.cancel_event.set()
+        self.end_time = time.time()
+        if errors:
+            raise errors[0]
+
+    def critical_path(self) -> list:
+        """
+        决定总耗时的步骤链: 按实际耗时计算的最长依赖路径
+        :return: [Stage]
+        """
+        producers = self.producers()
+        finish = {}
+        previous = {}
+        for stage in sorted(filter(lambda s: s.end_time is not None, self.stages), key=lambda s: s.end_time):
+            best = None
+            for dep in self.dependencies(stage, producers):
+                if dep in finish and (best is None or finish[dep] > finish[best]):
+                    best = dep
+            finish[stage] = stage.duration + (finish[best] if best else 0.0)
+            previous[stage] = best
+        if not finish:
+            return []
+        stage = max(finish, key=lambda s: finish[s])
+        path = []
+        while stage:
+            path.append(stage)
+            stage = previous[stage]
+        return list(reversed(path))
+
+    def summary(self) -> str:
+        """
+        总耗时和关键路径
+        """
+        lines = [f"总耗时:{(self.end_time or time.time()) - (self.start_time or time.time()):.2f}s"
+                 f" cpu预算:{self.cpu_budget}"
+                 f" 内存预算:{f'{self.memory_budget // 1024 // 1024}MB' if self.memory_budget else '不限制'}"]
+        path = self.critical_path()
+        lines.append(f"关键路径:{sum(s.duration for s in path):.2f}s")
+        for stage in path:
+            lines.append(f"  {stage.name} {stage.duration:.2f}s")
+        return "\n".join(lines)
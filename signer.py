@@ -0,0 +1,331 @@
+# coding=utf-8
+"""
+Copyright (C) 2021 37手游安卓团队
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import base64
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import zipfile
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    from cryptography.hazmat.primitives.serialization import pkcs7, pkcs12
+except ImportError:
+    # 没有安装cryptography的时候只能使用jarsigner签名
+    pkcs12 = None
+
+if hasattr(sys, "_flask"):
+    from .utils import execute_cmd, zip_copy_entry
+else:
+    try:
+        from utils import execute_cmd, zip_copy_entry
+    except:
+        from .utils import execute_cmd, zip_copy_entry
+
+# 签名的摘要算法: (MANIFEST.MF里面的属性名前缀, hashlib的算法名)
+DIGEST_ALGORITHMS = {
+    "SHA-256": ("SHA-256", "sha256"),
+    "SHA1": ("SHA1", "sha1"),
+}
+# cryptography的PKCS7签名只支持SHA-2， SHA1只能使用jarsigner
+SIGNER_DIGESTS = ("SHA-256",)
+CREATED_BY = "1.0 (37 build_aab_tool)"
+JKS_MAGIC = (b"\xfe\xed\xfe\xed", b"\xce\xce\xce\xce")
+SIGNATURE_FILE_PATTERN = re.compile(r"^META-INF/([^/]+\.(SF|RSA|DSA|EC)|MANIFEST\.MF|SIG-[^/]+)$", re.IGNORECASE)
+READ_CHUNK_SIZE = 1024 * 1024
+
+# 加载过的签名key， 常驻的服务不用每次都读取keystore
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+
+def is_available() -> bool:
+    """
+    是否可以使用python签名（需要安装cryptography）
+    """
+    return pkcs12 is not None
+
+
+def load_signing_key(keystore: str, storepass: str, alias: str, keypass: str):
+    """
+    读取keystore里面的私钥和证书， JKS格式的keystore先使用keytool转成PKCS12
+    :return: (私钥, 证书, 证书链)
+    """
+    stat = os.stat(keystore)
+    cache_key = (os.path.realpath(keystore), stat.st_size, stat.st_mtime_ns, storepass, alias, keypass)
+    with _key_cache_lock:
+        if cache_key in _key_cache:
+            return _key_cache[cache_key]
+
+    def match_alias(p12):
+        if p12.key is None or p12.cert is None:
+            return False
+        return not p12.cert.friendly_name or p12.cert.friendly_name.decode("UTF-8").lower() == alias.lower()
+
+    with open(keystore, "rb") as f:
+        data = f.read()
+    p12 = None
+    if data[:4] not in JKS_MAGIC:
+        try:
+            p12 = pkcs12.load_pkcs12(data, storepass.encode("UTF-8"))
+        except ValueError:
+            p12 = None
+    if p12 is None or not match_alias(p12):
+        # JKS，或者PKCS12里面有多个key的时候， 使用keytool导出alias对应的key
+        p12 = pkcs12.load_pkcs12(convert_to_pkcs12(keystore, storepass, alias, keypass), keypass.encode("UTF-8"))
+    if not match_alias(p12):
+        raise ValueError(f"keystore里面没有alias对应的私钥:{alias}")
+    chain = [c.certificate for c in p12.additional_certs]
+    key_entry = (p12.key, p12.cert.certificate, chain)
+    with _key_cache_lock:
+        _key_cache[cache_key] = key_entry
+    return key_entry
+
+
+def convert_to_pkcs12(keystore: str, storepass: str, alias: str, keypass: str) -> bytes:
+    """
+    使用keytool把JKS格式的keystore里面的一个alias转成PKCS12， 密码使用keypass
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        p12_path = os.path.join(temp_dir, "key.p12")
+        status, msg = execute_cmd(["keytool", "-importkeystore", "-noprompt",
+                                   "-srckeystore", keystore, "-srcstorepass", storepass,
+                                   "-srcalias", alias, "-srckeypass", keypass,
+                                   "-destkeystore", p12_path, "-deststoretype", "PKCS12",
+                                   "-deststorepass", keypass, "-destkeypass", keypass])
+        if status != 0 or not os.path.exists(p12_path):
+            raise ValueError(f"keystore转换PKCS12失败:{msg}")
+        with open(p12_path, "rb") as f:
+            return f.read()
+
+
+def manifest_line(text: str) -> bytes:
+    """
+    MANIFEST.MF 的一行， 超过72字节的时候换行， 后面的行以空格开头
+    """
+    data = text.encode("UTF-8")
+    lines = []
+    limit = 72
+    while len(data) > limit:
+        end = limit
+        # 不能从一个utf-8字符中间断开
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        lines.append(data[:end])
+        data = data[end:]
+        limit = 71
+    lines.append(data)
+    return b"\r\n ".join(lines) + b"\r\n"
+
+
+def signature_name(alias: str) -> str:
+    """
+    签名文件名， 和jarsigner一样使用alias的前8个字符
+    """
+    return re.sub(r"[^A-Z0-9_-]", "_", alias.upper()[:8])
+
+
+def entry_digest(buf, info: zipfile.ZipInfo, algorithm: str) -> bytes:
+    """
+    计算zip里面一个文件（解压之后）的摘要， 直接读取mmap， 不复制到内存
+    :param buf: zip文件的mmap
+    :param info: 文件信息
+    :param algorithm: hashlib的算法名
+    """
+    name_length, extra_length = struct.unpack_from("<HH", buf, info.header_offset + 26)
+    offset = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+    h = hashlib.new(algorithm)
+    with memoryview(buf) as view:
+        data = view[offset:offset + info.compress_size]
+        if info.compress_type == zipfile.ZIP_STORED:
+            h.update(data)
+        elif info.compress_type == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-15)
+            for start in range(0, len(data), READ_CHUNK_SIZE):
+                h.update(decompressor.decompress(data[start:start + READ_CHUNK_SIZE]))
+            h.update(decompressor.flush())
+        else:
+            raise ValueError(f"不支持的压缩方式:{info.filename} {info.compress_type}")
+        data.release()
+    return h.digest()
+
+
+def read_main_section(zip_path: str):
+    """
+    zip里面原来的MANIFEST.MF的主属性， 没有的话返回None
+    """
+    with zipfile.ZipFile(zip_path, "r") as z:
+        if "META-INF/MANIFEST.MF" not in z.NameToInfo:
+            return None
+        old_manifest = z.read("META-INF/MANIFEST.MF").replace(b"\r\n", b"\n").split(b"\n\n")[0]
+    return b"\r\n".join(filter(None, old_manifest.split(b"\n"))) + b"\r\n\r\n"
+
+
+def digest_entries(zip_path: str, infos: list, digest: str = "SHA-256", workers=None) -> list:
+    """
+    并行计算zip里面多个文件的摘要
+    :param zip_path: zip的路径
+    :param infos: 需要计算的文件
+    :param digest: SHA-256 或者 SHA1
+    :param workers: 线程数
+    :return: 和infos对应的摘要
+    """
+    algorithm = DIGEST_ALGORITHMS[digest][1]
+    if not infos:
+        return []
+    with open(zip_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        # hashlib和zlib计算的时候会释放GIL， 多线程可以同时计算
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            return list(executor.map(lambda x: entry_digest(buf, x, algorithm), infos))
+
+
+def build_v1_signature(entry_digests: list, key, cert, chain: list, alias: str, digest: str = "SHA-256",
+                       main_section: bytes = None) -> list:
+    """
+    生成v1（jar）签名的 MANIFEST.MF, .SF, 签名块
+    :param entry_digests: [(zip里面的路径, 摘要)]， 按写入zip的顺序
+    :param key: 私钥
+    :param cert: 证书
+    :param chain: 证书链
+    :param alias: 签名的alias， 用来生成签名文件名
+    :param digest: 只支持 SHA-256
+    :param main_section: MANIFEST.MF的主属性， 默认只有 Manifest-Version 和 Created-By
+    :return: [(签名文件名, 内容)]
+    """
+    if digest not in SIGNER_DIGESTS:
+        raise ValueError(f"python签名不支持摘要算法 {digest}， 可选: {', '.join(SIGNER_DIGESTS)}")
+    attribute, algorithm = DIGEST_ALGORITHMS[digest]
+    if main_section is None:
+        main_section = manifest_line("Manifest-Version: 1.0") + manifest_line(f"Created-By: {CREATED_BY}") + b"\r\n"
+    sections = []
+    for name, entry_hash in entry_digests:
+        sections.append(manifest_line(f"Name: {name}") +
+                        manifest_line(f"{attribute}-Digest: {base64.b64encode(entry_hash).decode()}") + b"\r\n")
+    manifest = main_section + b"".join(sections)
+
+    def b64_digest(data: bytes) -> str:
+        return base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+
+    signature_file = [manifest_line("Signature-Version: 1.0"),
+                      manifest_line(f"Created-By: {CREATED_BY}"),
+                      manifest_line(f"{attribute}-Digest-Manifest: {b64_digest(manifest)}"),
+                      manifest_line(f"{attribute}-Digest-Manifest-Main-Attributes: {b64_digest(main_section)}"),
+                      b"\r\n"]
+    for (name, _), section in zip(entry_digests, sections):
+        signature_file.append(manifest_line(f"Name: {name}") +
+                              manifest_line(f"{attribute}-Digest: {b64_digest(section)}") + b"\r\n")
+    signature_file = b"".join(signature_file)
+
+    if isinstance(key, rsa.RSAPrivateKey):
+        block_suffix = "RSA"
+    elif isinstance(key, ec.EllipticCurvePrivateKey):
+        block_suffix = "EC"
+    else:
+        raise ValueError(f"不支持的签名key类型:{type(key).__name__}")
+    builder = pkcs7.PKCS7SignatureBuilder().set_data(signature_file) \
+        .add_signer(cert, key, hashes.SHA256())
+    for chain_cert in chain:
+        builder = builder.add_certificate(chain_cert)
+    signature_block = builder.sign(serialization.Encoding.DER,
+                                   [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.NoAttributes])
+
+    name = signature_name(alias)
+    return [("META-INF/MANIFEST.MF", manifest),
+            (f"META-INF/{name}.SF", signature_file),
+            (f"META-INF/{name}.{block_suffix}", signature_block)]
+
+
+def write_signed_zip(out_path: str, sources: list, keystore: str = None, storepass: str = None,
+                     keypass: str = None, alias: str = None, digest: str = "SHA-256", workers=None):
+    """
+    把多个zip里面的文件原样（不重新压缩）写到一个zip，同时完成v1签名: 签名文件写在最前面，只写一次输出文件。
+    源zip里面原来的签名文件会被去掉
+    :param out_path: 输出的zip， 先写临时文件， 完成后rename
+    :param sources: [(源zip的路径, 目标目录)]， 目标目录为空的时候路径不变， 第一个zip的MANIFEST.MF主属性会保留
+    :param keystore: 签名文件， 为None的时候不签名
+    :param storepass: 签名文件的密码
+    :param keypass: key的密码
+    :param alias: key的alias
+    :param digest: 只支持 SHA-256
+    :param workers: 并行计算摘要的线程数
+    :return:
+    """
+    if keystore and digest not in SIGNER_DIGESTS:
+        raise ValueError(f"python签名不支持摘要算法 {digest}， 可选: {', '.join(SIGNER_DIGESTS)}")
+    plan = []
+    names = set()
+    for zip_path, parent_dir_name in sources:
+        with zipfile.ZipFile(zip_path, "r") as z:
+            infos = []
+            for info in z.infolist():
+                if info.is_dir() or SIGNATURE_FILE_PATTERN.match(info.filename):
+                    continue
+                arcname = parent_dir_name + "/" + info.filename if parent_dir_name else info.filename
+                if arcname in names:
+                    raise ValueError(f"重复的文件:{arcname}")
+                names.add(arcname)
+                infos.append((info, arcname))
+        plan.append((zip_path, infos))
+
+    signature_files = []
+    if keystore:
+        key, cert, chain = load_signing_key(keystore, storepass, alias, keypass)
+        entry_digests = []
+        for zip_path, infos in plan:
+            digests = digest_entries(zip_path, [info for info, _ in infos], digest, workers)
+            entry_digests.extend(zip([arcname for _, arcname in infos], digests))
+        main_section = read_main_section(sources[0][0]) if sources else None
+        signature_files = build_v1_signature(entry_digests, key, cert, chain, alias, digest, main_section)
+
+    temp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_DEFLATED) as dst_zip:
+            for name, data in signature_files:
+                dst_zip.writestr(name, data)
+            for zip_path, infos in plan:
+                with zipfile.ZipFile(zip_path, "r") as src_zip:
+                    for info, arcname in infos:
+                        zip_copy_entry(src_zip, info, dst_zip, arcname)
+        os.replace(temp_path, out_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return 0, "success"
+
+
+def sign_jar(jar_path: str, keystore: str, storepass: str, keypass: str, alias: str, digest: str = "SHA-256",
+             workers=None):
+    """
+    v1签名（和jarsigner一样）， 签名文件放在最前面， 其他文件直接拷贝压缩后的数据
+    :param jar_path: 需要签名的zip（aab）， 签名后覆盖
+    :param keystore: 签名文件
+    :param storepass: 签名文件的密码
+    :param keypass: key的密码
+    :param alias: key的alias
+    :param digest: 只支持 SHA-256
+    :param workers: 并行计算摘要的线程数
+    :return:
+    """
+    return write_signed_zip(jar_path, [(jar_path, "")], keystore, storepass, keypass, alias, digest, workers)
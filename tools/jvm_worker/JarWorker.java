@@ -0,0 +1,149 @@
+/*
+ * Copyright (C) 2021 37手游安卓团队
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.jar.JarFile;
+
+/**
+ * 常驻的jvm进程， 加载一次jar（apktool, bundletool）之后重复执行它的main方法。
+ * <p>
+ * 启动: java -cp xxx.jar JarWorker.java xxx.jar
+ * <p>
+ * 协议（和 aapt2 daemon 类似）:
+ * 启动完成后在stdout输出 Ready （不能拦截System.exit的jvm输出 Unsupported 然后退出）；
+ * 从stdin读取命令，每行一个参数，空行结束一条命令， quit 退出；
+ * 执行完成后在stdout输出 "Done 退出码 输出的字节数"，然后是main方法输出的内容（System.out和System.err）
+ */
+public class JarWorker {
+
+    /**
+     * main方法里面调用System.exit的时候抛出，结束这条命令
+     */
+    static class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    /**
+     * 把System.out和System.err写到当前命令的缓存里面
+     */
+    static class CaptureStream extends OutputStream {
+        ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+
+        @Override
+        public synchronized void write(int b) {
+            buffer.write(b);
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            buffer.write(b, off, len);
+        }
+
+        synchronized byte[] take() {
+            byte[] data = buffer.toByteArray();
+            buffer = new ByteArrayOutputStream();
+            return data;
+        }
+    }
+
+    @SuppressWarnings("removal")
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        String mainClassName;
+        try (JarFile jarFile = new JarFile(args[0])) {
+            mainClassName = jarFile.getManifest().getMainAttributes().getValue("Main-Class");
+        }
+        Method mainMethod = Class.forName(mainClassName).getMethod("main", String[].class);
+
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitException(status);
+                }
+            });
+        } catch (UnsupportedOperationException | SecurityException e) {
+            protocol.println("Unsupported");
+            return;
+        }
+
+        CaptureStream capture = new CaptureStream();
+        PrintStream captureStream = new PrintStream(capture, true, "UTF-8");
+        System.setOut(captureStream);
+        System.setErr(captureStream);
+
+        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("Ready");
+        List<String> command = new ArrayList<>();
+        String line;
+        while ((line = reader.readLine()) != null) {
+            if (!line.isEmpty()) {
+                command.add(line);
+                continue;
+            }
+            if (command.isEmpty()) {
+                continue;
+            }
+            if (command.size() == 1 && "quit".equals(command.get(0))) {
+                break;
+            }
+            int status = 0;
+            try {
+                mainMethod.invoke(null, (Object) command.toArray(new String[0]));
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitException) {
+                    status = ((ExitException) cause).status;
+                } else {
+                    cause.printStackTrace();
+                    status = 1;
+                }
+            }
+            command.clear();
+            System.out.flush();
+            byte[] output = capture.take();
+            protocol.println("Done " + status + " " + output.length);
+            protocol.write(output);
+            protocol.flush();
+        }
+        System.setSecurityManager(null);
+    }
+}
@@ -14,11 +14,21 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import bisect
+import errno
+import hashlib
 import os
 import shutil
+import struct
+import subprocess
+import threading
+import time
 import zipfile
 import platform
 
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
 WINDOWS = "Windows"
 Linux = "Linux"
 MACOS = "Darwin"
@@ -28,10 +38,302 @@ def get_system() -> str:
     return platform.system()
 
 
-def execute_cmd(cmd):
-    # print("#" * 10, cmd)
-    status = os.system(cmd)
-    return status, ""
+# 每个命令最多保留的输出（字节），stdout和stderr分别计算， 超过的只保留末尾部分
+CMD_OUTPUT_LIMIT = 64 * 1024
+
+_cmd_local = threading.local()
+
+# 按工具统计的执行次数和耗时
+_cmd_stats = {}
+_cmd_stats_lock = threading.Lock()
+
+
+class CmdResult:
+    """
+    一次命令执行的结果: 退出码，输出，耗时，cpu时间，内存峰值
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.status = -1
+        self.stdout = ""
+        self.stderr = ""
+        self.wall_time = 0.0
+        # 以下数据只有linux和mac有（wait4）
+        self.user_time = None
+        self.sys_time = None
+        self.max_rss = None
+        self.timed_out = False
+        self.cancelled = False
+
+    @property
+    def tool(self) -> str:
+        """
+        执行的工具名， java -jar 的时候为jar的名字
+        """
+        args = self.cmd.split() if isinstance(self.cmd, str) else list(map(str, self.cmd))
+        if not args:
+            return ""
+        if "-jar" in args and args.index("-jar") + 1 < len(args):
+            return os.path.basename(args[args.index("-jar") + 1])
+        return os.path.basename(args[0])
+
+    @property
+    def output(self) -> str:
+        return "\n".join(filter(None, [self.stdout.strip(), self.stderr.strip()]))
+
+    def summary(self) -> str:
+        text = f"[{self.tool}] status:{self.status} 耗时:{self.wall_time:.2f}s"
+        if self.user_time is not None:
+            text += f" user:{self.user_time:.2f}s sys:{self.sys_time:.2f}s 内存峰值:{self.max_rss / 1024 / 1024:.1f}MB"
+        if self.timed_out:
+            text += " 超时"
+        if self.cancelled:
+            text += " 已取消"
+        return text
+
+
+class _OutputReader(threading.Thread):
+    """
+    读取子进程的输出， 只保留末尾的 CMD_OUTPUT_LIMIT 字节
+    """
+
+    def __init__(self, pipe):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.data = bytearray()
+
+    def run(self):
+        for chunk in iter(lambda: self.pipe.read(8192), b""):
+            self.data += chunk
+            if len(self.data) > CMD_OUTPUT_LIMIT * 2:
+                del self.data[:-CMD_OUTPUT_LIMIT]
+        self.pipe.close()
+
+    def text(self) -> str:
+        return bytes(self.data[-CMD_OUTPUT_LIMIT:]).decode("UTF-8", errors="replace")
+
+
+class cmd_scope:
+    """
+    设置当前线程执行命令的默认超时时间，取消信号，并且记录执行过的命令
+    with cmd_scope(timeout=600) as results:
+        execute_cmd(...)
+    """
+
+    def __init__(self, timeout=None, cancel_event=None, inherit=True):
+        parent = getattr(_cmd_local, "scope", None) if inherit else None
+        self.timeout = timeout if timeout is not None or parent is None else parent.timeout
+        self.cancel_event = cancel_event if cancel_event is not None or parent is None else parent.cancel_event
+        self.results = []
+        self.parent = None
+
+    def __enter__(self):
+        self.parent = getattr(_cmd_local, "scope", None)
+        _cmd_local.scope = self
+        return self.results
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _cmd_local.scope = self.parent
+        if self.parent is not None:
+            self.parent.results.extend(self.results)
+
+    def record(self, result: CmdResult):
+        self.results.append(result)
+
+
+def bind_cmd_scope(fun):
+    """
+    在线程池里面执行的时候，使用提交任务的线程的cmd_scope
+    """
+    scope = getattr(_cmd_local, "scope", None)
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_cmd_local, "scope", None)
+        _cmd_local.scope = scope
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            _cmd_local.scope = previous
+
+    return wrapper
+
+
+def _exit_status(wait_status) -> int:
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def _kill(process):
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, 9)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+
+def run_cmd(cmd, timeout=None, cancel_event=None, cwd=None) -> CmdResult:
+    """
+    执行命令
+    :param cmd: 参数列表（不经过shell）， 或者字符串（通过shell执行，可以使用管道）
+    :param timeout: 超时时间（秒）， 超时后结束进程
+    :param cancel_event: threading.Event， set之后结束进程
+    :param cwd: 工作目录
+    :return: CmdResult
+    """
+    scope = getattr(_cmd_local, "scope", None)
+    if scope is not None:
+        timeout = timeout if timeout is not None else scope.timeout
+        cancel_event = cancel_event if cancel_event is not None else scope.cancel_event
+    result = CmdResult(cmd)
+    if cancel_event is not None and cancel_event.is_set():
+        result.cancelled = True
+        return result
+    start_time = time.time()
+    shell = isinstance(cmd, str)
+    process = subprocess.Popen(cmd if shell else list(map(str, cmd)), shell=shell, cwd=cwd,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               start_new_session=os.name == "posix")
+    readers = [_OutputReader(process.stdout), _OutputReader(process.stderr)]
+    for reader in readers:
+        reader.start()
+
+    # 子进程在新的进程组里面， 中断（例如Ctrl-C）或者异常的时候也要结束， 否则会留下孤儿进程
+    try:
+        delay = 0.001
+        while True:
+            if os.name == "posix":
+                wait_flags = 0 if timeout is None and cancel_event is None else os.WNOHANG
+                pid, wait_status, rusage = os.wait4(process.pid, wait_flags)
+                if pid != 0:
+                    process.returncode = _exit_status(wait_status)
+                    result.user_time = rusage.ru_utime
+                    result.sys_time = rusage.ru_stime
+                    # linux 单位是KB， mac是字节
+                    result.max_rss = rusage.ru_maxrss * (1 if get_system() == MACOS else 1024)
+                    break
+            else:
+                try:
+                    process.wait(timeout=delay)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+            if timeout is not None and time.time() - start_time > timeout and not result.timed_out:
+                result.timed_out = True
+                _kill(process)
+            if cancel_event is not None and cancel_event.is_set() and not result.cancelled:
+                result.cancelled = True
+                _kill(process)
+            if os.name == "posix":
+                time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    except BaseException:
+        _kill(process)
+        process.wait()
+        for reader in readers:
+            reader.join()
+        raise
+
+    for reader in readers:
+        reader.join()
+    result.status = process.returncode
+    result.stdout = readers[0].text()
+    result.stderr = readers[1].text()
+    result.wall_time = time.time() - start_time
+    record_cmd_result(result)
+    return result
+
+
+def record_cmd_result(result: CmdResult):
+    """
+    记录没有通过run_cmd执行的命令（例如交给常驻进程执行的），统计到当前的cmd_scope和按工具的统计里面
+    """
+    scope = getattr(_cmd_local, "scope", None)
+    if scope is not None:
+        scope.record(result)
+    with _cmd_stats_lock:
+        stats = _cmd_stats.setdefault(result.tool, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += result.wall_time
+        stats[2] += (result.user_time or 0) + (result.sys_time or 0)
+
+
+class cmd_watchdog:
+    """
+    交给常驻进程执行的命令使用当前cmd_scope的超时时间和取消信号: 超时或者取消的时候结束常驻进程，
+    阻塞在读取输出的线程会读到EOF， 调用方需要重新启动常驻进程
+    with cmd_watchdog(process, result):
+        读取输出
+    """
+
+    def __init__(self, process, result: CmdResult):
+        scope = getattr(_cmd_local, "scope", None)
+        self.timeout = scope.timeout if scope is not None else None
+        self.cancel_event = scope.cancel_event if scope is not None else None
+        self.process = process
+        self.result = result
+        self.done = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            # 还没有开始执行， 不需要结束进程
+            self.result.cancelled = True
+        elif self.timeout is not None or self.cancel_event is not None:
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _watch(self):
+        start_time = time.time()
+        delay = 0.001
+        while not self.done.wait(delay):
+            if self.timeout is not None and time.time() - start_time > self.timeout:
+                self.result.timed_out = True
+            elif self.cancel_event is not None and self.cancel_event.is_set():
+                self.result.cancelled = True
+            else:
+                delay = min(delay * 2, 0.05)
+                continue
+            try:
+                self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+            return
+
+
+def cmd_stats_summary(reset=True) -> str:
+    """
+    各个工具的执行次数， 总耗时， 总cpu时间
+    """
+    with _cmd_stats_lock:
+        items = sorted(_cmd_stats.items(), key=lambda item: item[1][1], reverse=True)
+        if reset:
+            _cmd_stats.clear()
+    return "\n".join(f"[{tool}] 次数:{count} 耗时:{wall:.2f}s cpu:{cpu:.2f}s" for tool, (count, wall, cpu) in items)
+
+
+def execute_cmd(cmd, timeout=None, cancel_event=None, cwd=None):
+    """
+    执行命令
+    :param cmd: 参数列表（不经过shell）， 或者字符串（通过shell执行，可以使用管道）
+    :return: status, 命令的输出
+    """
+    result = run_cmd(cmd, timeout=timeout, cancel_event=cancel_event, cwd=cwd)
+    if result.timed_out:
+        return result.status or -1, f"执行超时:{result.output}"
+    if result.cancelled:
+        return result.status or -1, f"已取消:{result.output}"
+    return result.status, result.output
 
 
 def read_file_text(file_path) -> str:
@@ -54,7 +356,142 @@ def get_file_name_list(file_dir: str):
     return file_name_list
 
 
-def zip_file(src_dir, zip_name="", parent_dir_name=""):
+class FileIndex:
+    """
+    目录下所有文件和目录的索引， 使用os.scandir扫描一次， 后面的步骤查询索引， 不再重复遍历目录。
+    路径（相对路径，使用 / 分隔）排好序， 大小， 修改时间， 类型按列存放在array里面， 文件很多的时候也比较省内存
+    """
+    KIND_FILE = 0
+    KIND_DIR = 1
+    # 已经被移走（删除）的文件
+    KIND_REMOVED = -1
+
+    def __init__(self, root: str):
+        self.root = root
+        self.paths = []
+        self.sizes = array("q")
+        self.mtimes = array("q")
+        self.kinds = array("b")
+        # {位置: sha256}， 需要的时候才计算
+        self.hashes = {}
+
+    def scan(self):
+        """
+        扫描目录， 重新建立索引
+        """
+        items = []
+        stack = [("", self.root)]
+        while stack:
+            prefix, dir_path = stack.pop()
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        items.append((path, 0, 0, self.KIND_DIR))
+                        stack.append((path + "/", entry.path))
+                    else:
+                        stat = entry.stat()
+                        items.append((path, stat.st_size, stat.st_mtime_ns, self.KIND_FILE))
+        items.sort()
+        self.paths = [item[0] for item in items]
+        self.sizes = array("q", (item[1] for item in items))
+        self.mtimes = array("q", (item[2] for item in items))
+        self.kinds = array("b", (item[3] for item in items))
+        self.hashes = {}
+        return 0, f"{len(self.paths)}个文件和目录"
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _position(self, path: str) -> int:
+        i = bisect.bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path and self.kinds[i] != self.KIND_REMOVED:
+            return i
+        return -1
+
+    def relpath(self, path: str):
+        """
+        绝对路径（或者相对当前目录的路径）转成索引里面的路径， 不在索引的目录下面返回None
+        """
+        path = os.path.relpath(path, self.root)
+        if path == os.curdir:
+            return ""
+        if path == os.pardir or path.startswith(os.pardir + os.sep) or os.path.isabs(path):
+            return None
+        return path.replace(os.sep, "/")
+
+    def join(self, path: str) -> str:
+        return os.path.join(self.root, *path.split("/")) if path else self.root
+
+    def kind(self, path: str):
+        """
+        :return: KIND_FILE, KIND_DIR， 不存在返回None
+        """
+        if path == "":
+            return self.KIND_DIR
+        i = self._position(path)
+        return self.kinds[i] if i >= 0 else None
+
+    def size(self, path: str) -> int:
+        return self.sizes[self._position(path)]
+
+    def mtime_ns(self, path: str) -> int:
+        return self.mtimes[self._position(path)]
+
+    def sha256(self, path: str) -> str:
+        i = self._position(path)
+        if i not in self.hashes:
+            self.hashes[i] = file_sha256(self.join(path))
+        return self.hashes[i]
+
+    def _under(self, dir_path: str):
+        """
+        目录下面（所有层级）的位置
+        """
+        prefix = dir_path + "/" if dir_path else ""
+        i = bisect.bisect_left(self.paths, prefix)
+        while i < len(self.paths) and self.paths[i].startswith(prefix):
+            if self.kinds[i] != self.KIND_REMOVED:
+                yield i
+            i += 1
+
+    def files(self, dir_path: str = "") -> list:
+        """
+        目录下面（所有层级）的文件
+        """
+        return [self.paths[i] for i in self._under(dir_path) if self.kinds[i] == self.KIND_FILE]
+
+    def file_sizes(self, dir_path: str = "") -> list:
+        """
+        目录下面（所有层级）的文件和大小 [(路径, 大小)]
+        """
+        return [(self.paths[i], self.sizes[i]) for i in self._under(dir_path) if self.kinds[i] == self.KIND_FILE]
+
+    def children(self, dir_path: str = "") -> list:
+        """
+        目录下面一层的文件和目录的名字
+        """
+        start = len(dir_path) + 1 if dir_path else 0
+        return [self.paths[i][start:] for i in self._under(dir_path) if "/" not in self.paths[i][start:]]
+
+    def discard(self, path: str):
+        """
+        文件或者目录被移走之后从索引里面去掉
+        """
+        i = self._position(path)
+        if i < 0:
+            return
+        positions = [i] + list(self._under(path)) if self.kinds[i] == self.KIND_DIR else [i]
+        for i in positions:
+            self.kinds[i] = self.KIND_REMOVED
+            self.hashes.pop(i, None)
+
+
+def zip_file(src_dir, zip_name="", parent_dir_name="", index: FileIndex = None):
+    """
+    压缩目录
+    :param index: src_dir的文件索引， 为None的时候扫描目录
+    """
     if not zip_name:
         zip_name = src_dir + '.zip'
     mode = "w"
@@ -62,22 +499,110 @@ def zip_file(src_dir, zip_name="", parent_dir_name=""):
         mode = "a"
     if "w" == mode and parent_dir_name == "":
         # 尝试调用一下系统的压缩方法，  速度快一点。。。
-        cmd = f"cd {src_dir} && zip -r -q -D {os.path.abspath(zip_name)} *"
-        status, message = execute_cmd(cmd)
+        try:
+            status, message = execute_cmd(["zip", "-r", "-q", "-D", os.path.abspath(zip_name), "."], cwd=src_dir)
+        except OSError:
+            status = -1
         if status == 0:
             return 0, "success",
         # 如果失败了，尝试去删除一下
         delete(zip_name)
+    if index is None:
+        index = FileIndex(src_dir)
+        index.scan()
+    fpath = parent_dir_name and parent_dir_name + "/" or ""
     z = zipfile.ZipFile(zip_name, mode, zipfile.ZIP_DEFLATED)
-    for dirpath, dirnames, filenames in os.walk(src_dir):
-        fpath = dirpath.replace(src_dir, parent_dir_name)
-        fpath = fpath and fpath + os.sep or ''
-        for filename in filenames:
-            z.write(os.path.join(dirpath, filename), fpath + filename)
+    for path in index.files():
+        z.write(index.join(path), fpath + path)
     z.close()
     return 0, "success"
 
 
+def zip_stream_entry(src_zip: zipfile.ZipFile, info: zipfile.ZipInfo, dst_zip: zipfile.ZipFile, arcname: str):
+    """
+    把一个zip里面的文件写入到另外一个zip， 不落地到磁盘
+    :param src_zip: 源zip
+    :param info: 源zip里面的文件信息
+    :param dst_zip: 目标zip
+    :param arcname: 目标zip里面的路径
+    """
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.file_size = info.file_size
+    with src_zip.open(info) as src, dst_zip.open(zinfo, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def zip_copy_entry(src_zip: zipfile.ZipFile, info: zipfile.ZipInfo, dst_zip: zipfile.ZipFile, arcname: str = None):
+    """
+    把一个zip里面的文件原样（压缩后的数据）拷贝到另外一个zip， 不解压也不重新压缩，crc和大小保持不变
+    :param src_zip: 源zip
+    :param info: 源zip里面的文件信息
+    :param dst_zip: 目标zip
+    :param arcname: 目标zip里面的路径， 默认和源zip一样
+    """
+    arcname = arcname or info.filename
+    if info.flag_bits & 0x1:
+        # 加密的文件没法直接拷贝，走解压再压缩
+        return zip_stream_entry(src_zip, info, dst_zip, arcname)
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.create_system = info.create_system
+    zinfo.external_attr = info.external_attr
+    # 只保留压缩参数的标记位, 大小和crc已知, 不需要data descriptor
+    zinfo.flag_bits = info.flag_bits & 0x6
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    with src_zip._lock, dst_zip._lock:
+        src_zip.fp.seek(info.header_offset)
+        header = src_zip.fp.read(zipfile.sizeFileHeader)
+        if header[0:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad magic number for file header: {info.filename}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        src_zip.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+        dst_zip._writecheck(zinfo)
+        dst_zip._didModify = True
+        dst_zip.fp.seek(dst_zip.start_dir)
+        zinfo.header_offset = dst_zip.fp.tell()
+        dst_zip.fp.write(zinfo.FileHeader(zip64))
+        remain = info.compress_size
+        while remain > 0:
+            data = src_zip.fp.read(min(remain, 1024 * 1024))
+            if not data:
+                raise EOFError(f"zip文件不完整: {info.filename}")
+            dst_zip.fp.write(data)
+            remain -= len(data)
+        dst_zip.start_dir = dst_zip.fp.tell()
+        dst_zip.filelist.append(zinfo)
+        dst_zip.NameToInfo[zinfo.filename] = zinfo
+
+
+def zip_merge(src_zip_path, dst_zip_path, parent_dir_name="", name_map=None):
+    """
+    把一个zip里面的文件原样拷贝到另外一个zip
+    :param src_zip_path: 源zip
+    :param dst_zip_path: 目标zip， 存在的话就追加
+    :param parent_dir_name: 拷贝到目标zip的哪个目录下
+    :param name_map: 需要重命名的文件 {源路径: 目标路径}
+    :return:
+    """
+    name_map = name_map or {}
+    mode = "a" if os.path.exists(dst_zip_path) else "w"
+    with zipfile.ZipFile(src_zip_path, "r") as src, zipfile.ZipFile(dst_zip_path, mode) as dst:
+        for info in src.infolist():
+            if info.is_dir():
+                continue
+            name = name_map.get(info.filename, info.filename)
+            if parent_dir_name:
+                name = parent_dir_name + "/" + name
+            zip_copy_entry(src, info, dst, name)
+    return 0, "success"
+
+
 def unzip_file(zip_src, dst_dir):
     r = zipfile.is_zipfile(zip_src)
     if r:
@@ -89,11 +614,121 @@ def unzip_file(zip_src, dst_dir):
     return 0, "success"
 
 
+# linux ioctl FICLONE， btrfs, xfs 等文件系统共享数据块（写时复制）
+FICLONE = 0x40049409
+
+# 移动，拷贝文件使用的方式的次数: rename, hardlink, reflink, copy
+_copy_stats = {}
+_copy_stats_lock = threading.Lock()
+# 不支持reflink的文件系统（st_dev）， 不再尝试
+_reflink_unsupported = set()
+# 表示文件系统不支持reflink的错误码
+REFLINK_UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EINVAL}
+
+
+def _count_copy(strategy: str):
+    with _copy_stats_lock:
+        _copy_stats[strategy] = _copy_stats.get(strategy, 0) + 1
+
+
+def copy_stats_summary(reset=True) -> str:
+    """
+    移动，拷贝文件使用的各种方式的次数
+    """
+    with _copy_stats_lock:
+        text = " ".join(f"{strategy}:{count}" for strategy, count in sorted(_copy_stats.items()))
+        if reset:
+            _copy_stats.clear()
+    return text
+
+
+def reflink(source_path, target_path) -> bool:
+    """
+    创建reflink（数据块共享，修改的时候才复制）， 只支持linux（FICLONE）和mac（clonefile）
+    :return: 是否成功， 不成功的时候不会留下目标文件
+    """
+    try:
+        device = os.stat(os.path.dirname(os.path.abspath(target_path))).st_dev
+        source_device = os.stat(source_path).st_dev
+    except OSError:
+        return False
+    # 不同的文件系统之间不能reflink（EXDEV）， 不影响同一个文件系统里面的拷贝
+    if device in _reflink_unsupported or device != source_device:
+        return False
+    platform_system = get_system()
+    try:
+        if platform_system == Linux:
+            import fcntl
+            with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        elif platform_system == MACOS:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.clonefile(os.fsencode(source_path), os.fsencode(target_path), 0) != 0:
+                raise OSError(ctypes.get_errno(), "clonefile")
+        else:
+            return False
+    except (OSError, AttributeError) as e:
+        # 只记录文件系统不支持的情况， 其他错误（例如文件不存在）只影响这一次
+        if not isinstance(e, OSError) or e.errno in REFLINK_UNSUPPORTED_ERRNOS:
+            _reflink_unsupported.add(device)
+        if platform_system == Linux and os.path.exists(target_path):
+            os.remove(target_path)
+        return False
+    return True
+
+
+def fast_copy_file(source_path, target_path, link=False):
+    """
+    拷贝一个文件， 按顺序尝试: 硬链接（link为True的时候）， reflink， 最后才复制数据
+    :param link: 源文件和目标文件之后都不会被修改的时候可以使用硬链接
+    """
+    if link:
+        try:
+            os.link(source_path, target_path)
+            _count_copy("hardlink")
+            return target_path
+        except OSError:
+            pass
+    if reflink(source_path, target_path):
+        _count_copy("reflink")
+        return target_path
+    shutil.copyfile(source_path, target_path)
+    _count_copy("copy")
+    return target_path
+
+
+def link_or_copy(source_path, target_path):
+    """
+    创建硬链接， 不支持的时候（跨磁盘, 文件系统不支持）使用reflink或者拷贝文件
+    """
+    return fast_copy_file(source_path, target_path, link=True)
+
+
 def mv(src_path, dst_path):
-    # TODO 可以有优化
-    copy(src_path, dst_path)
-    delete(src_path)
-    return 0, "success"
+    """
+    移动文件或者目录， 同一个文件系统直接rename， 不是的话拷贝之后删除
+    """
+    if not os.path.exists(src_path):
+        return 0, "文件不存在，但是直接给成功。"
+    if os.path.exists(dst_path):
+        status, msg = delete(dst_path)
+        if status != 0:
+            return status, msg
+    dst_dirname = os.path.dirname(dst_path)
+    if dst_dirname:
+        os.makedirs(dst_dirname, exist_ok=True)
+    try:
+        os.rename(src_path, dst_path)
+        _count_copy("rename")
+        return 0, "success"
+    except OSError:
+        # 跨文件系统（EXDEV）
+        pass
+    status, msg = copy(src_path, dst_path)
+    if status != 0:
+        return status, msg
+    return delete(src_path)
 
 
 def delete(path):
@@ -107,9 +742,9 @@ def delete(path):
         if platform_system == WINDOWS:
             cmd = f"rd /s /q {path}"
         elif platform_system == Linux:
-            cmd = f"rm -rf {path}"
+            cmd = ["rm", "-rf", path]
         elif platform_system == MACOS:
-            cmd = f"rm -rf {path}"
+            cmd = ["rm", "-rf", path]
 
         if not cmd:
             shutil.rmtree(path)
@@ -119,7 +754,11 @@ def delete(path):
     return 0, "success"
 
 
-def copy(source_path, target_path):
+def copy(source_path, target_path, link=False):
+    """
+    拷贝文件或者目录， 目标存在的时候先删除。 优先使用reflink， link为True的时候优先使用硬链接
+    :param link: 源文件和目标文件之后都不会被修改的时候可以使用硬链接
+    """
     if not os.path.exists(source_path):
         return 0, "文件不存在，但是直接给成功。有的项目没有lib文件夹"
     if os.path.isfile(source_path):
@@ -133,7 +772,226 @@ def copy(source_path, target_path):
         if status != 0:
             return status, msg
     if os.path.isdir(source_path):
-        shutil.copytree(source_path, target_path)
+        shutil.copytree(source_path, target_path, copy_function=lambda src, dst: fast_copy_file(src, dst, link))
     else:
-        shutil.copyfile(source_path, target_path)
+        fast_copy_file(source_path, target_path, link)
     return 0, "success"
+
+
+# 多线程拷贝文件的线程数， 拷贝主要是等待io， 线程数可以比cpu多
+COPY_WORKERS = 16
+
+
+class CopyPlan:
+    """
+    先收集需要拷贝的所有文件， 再多线程按文件拷贝，
+    大量小文件的目录不用一个一个文件按顺序拷贝
+    """
+
+    def __init__(self, link=False):
+        """
+        :param link: 源文件和目标文件之后都不会被修改的时候使用硬链接
+        """
+        # {目标文件: 源文件}
+        self.files = {}
+        self.link = link
+
+    def add(self, source_path, target_path, index: FileIndex = None):
+        """
+        添加需要拷贝的文件或者目录， 和copy一样， 目标已经存在的话覆盖（之前添加到这个目标下面的文件不再拷贝）,
+        源文件不存在的时候忽略
+        :param index: 源文件所在目录的索引， 不为None的时候从索引查询文件， 不遍历目录
+        """
+        prefix = os.path.join(target_path, "")
+        for path in [p for p in self.files if p == target_path or p.startswith(prefix)]:
+            del self.files[path]
+        source = index.relpath(source_path) if index else None
+        if source is not None:
+            kind = index.kind(source)
+            if kind == FileIndex.KIND_FILE:
+                self.files[target_path] = source_path
+            elif kind == FileIndex.KIND_DIR:
+                start = len(source) + 1 if source else 0
+                for path in index.files(source):
+                    self.files[os.path.normpath(os.path.join(target_path, path[start:]))] = index.join(path)
+        elif os.path.isfile(source_path):
+            self.files[target_path] = source_path
+        elif os.path.isdir(source_path):
+            for root, _, files in os.walk(source_path):
+                target_root = os.path.join(target_path, os.path.relpath(root, source_path))
+                for name in files:
+                    self.files[os.path.normpath(os.path.join(target_root, name))] = os.path.join(root, name)
+        return 0, "success"
+
+    def execute(self, workers=COPY_WORKERS):
+        """
+        拷贝所有文件
+        """
+        for target_dir in sorted(set(map(os.path.dirname, self.files))):
+            os.makedirs(target_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda item: fast_copy_file(item[1], item[0], self.link), self.files.items()))
+        return 0, f"拷贝了{len(self.files)}个文件"
+
+
+_file_sha256_cache = {}
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    文件的sha256， 文件的大小和修改时间没有变化的时候直接返回上一次的结果
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_sha256_cache:
+        h = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for data in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(data)
+        _file_sha256_cache[memo_key] = h.hexdigest()
+    return _file_sha256_cache[memo_key]
+
+
+class FileCache:
+    """
+    本地文件缓存: 按key存放文件或者目录, 超过大小上限的时候删除最久没有使用的。
+    写入的时候先写临时文件再rename，多个进程同时使用同一个缓存目录也不会读到写了一半的数据。
+    目录的大小在写入的时候记录到 {key}.size， 清理的时候不用遍历目录
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        """
+        :param cache_dir: 缓存目录
+        :param max_size: 缓存大小上限（字节）
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        # 上一次清理之后的缓存大小加上这个进程写入的大小， None表示还没有统计过
+        self.total_size = None
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key: str):
+        """
+        :return: 缓存的路径， 没有缓存返回None
+        """
+        path = self.path(key)
+        try:
+            # 更新修改时间，用来判断最近有没有使用
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key: str, source_path: str, link=False) -> str:
+        """
+        写入缓存
+        :param key: 缓存的key
+        :param source_path: 需要缓存的文件或者目录
+        :param link: 使用硬链接代替拷贝，源文件之后不能被修改
+        :return: 缓存的路径
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        copy_function = link_or_copy if link else fast_copy_file
+        if os.path.isdir(source_path):
+            shutil.copytree(source_path, temp_path, copy_function=copy_function)
+            size = get_path_size(temp_path)
+            self._write_size(path, size)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # 其他进程已经写入了
+                shutil.rmtree(temp_path, ignore_errors=True)
+        else:
+            copy_function(source_path, temp_path)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        with self.lock:
+            if self.total_size is not None:
+                self.total_size += size
+        return path
+
+    @staticmethod
+    def _write_size(path: str, size: int):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.size.tmp"
+        with open(temp_path, "w") as f:
+            f.write(str(size))
+        os.replace(temp_path, f"{path}.size")
+
+    @staticmethod
+    def _entry_size(entry) -> int:
+        if not entry.is_dir():
+            return entry.stat().st_size
+        try:
+            with open(f"{entry.path}.size", "r") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            # 没有记录大小的目录（旧版本写入的）， 统计一次之后记录下来
+            size = get_path_size(entry.path)
+            if os.path.isdir(entry.path):
+                FileCache._write_size(entry.path, size)
+            return size
+
+    def evict(self):
+        """
+        超过大小上限的时候，删除最久没有使用的缓存。
+        已知的大小没有超过上限的时候不扫描缓存目录
+        """
+        with self.lock:
+            if self.total_size is not None and self.total_size <= self.max_size:
+                return 0, "success"
+        entries = []
+        total_size = 0
+        for bucket in os.scandir(self.cache_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(".tmp") or entry.name.endswith(".size"):
+                    continue
+                try:
+                    size = self._entry_size(entry)
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:
+                    # 同时有其他线程或者进程在清理
+                    continue
+                total_size += size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            try:
+                os.remove(f"{path}.size")
+            except OSError:
+                pass
+            total_size -= size
+        with self.lock:
+            self.total_size = total_size
+        return 0, "success"
+
+
+def get_path_size(path) -> int:
+    """
+    文件或者目录的大小
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return size